@@ -0,0 +1,66 @@
+"""
+Memory and throughput of the objects returned when iterating over a storage:
+libcloud objects wrapped in Object, in ListedObject, and the objects yielded
+by iterating over a LOCAL storage
+
+    PYTHONPATH=. python benchmarks/bench_listing.py [count]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+from libcloud.storage.base import Object as BaseObject, Container
+from libcloud.storage.drivers.dummy import DummyStorageDriver
+from flask_cloudy import Storage, Object, ListedObject
+
+
+def driver_objects(count, container, driver):
+    for i in range(count):
+        yield BaseObject(name="dir/object-%s.jpg" % i,
+                         size=i,
+                         hash="%032x" % i,
+                         extra={"last_modified": "2017-01-01T00:00:00.000Z",
+                                "content_type": "image/jpeg"},
+                         meta_data={"owner": "user-%s" % i},
+                         container=container,
+                         driver=driver)
+
+
+def report(name, iterate, count):
+    start = time.time()
+    for o in iterate():
+        o.name, o.size, o.hash
+    elapsed = time.time() - start
+
+    tracemalloc.start()
+    objects = list(iterate())
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-14s %8.1f bytes/object %10.0f objects/s" % (name, size / float(count), count / elapsed))
+    return objects
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    driver = DummyStorageDriver("key", "secret")
+    container = Container(name="container", extra={}, driver=driver)
+    report("Object",
+           lambda: (Object(obj=obj) for obj in driver_objects(count, container, driver)),
+           count)
+    report("ListedObject",
+           lambda: (ListedObject.from_driver_object(obj) for obj in driver_objects(count, container, driver)),
+           count)
+
+    # What `for obj in storage` yields, with the storage and its throttles
+    path = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(path, "dir"))
+        for i in range(count):
+            open(os.path.join(path, "dir", "object-%s.jpg" % i), "wb").close()
+        storage = Storage(provider="LOCAL", container=path)
+        report("iter(storage)", lambda: iter(storage), count)
+    finally:
+        shutil.rmtree(path)
@@ -0,0 +1,62 @@
+"""
+LOCAL provider with all the objects in a single directory: flat layout through
+the libcloud driver, flat layout with the Storage fast paths, and the sharded layout
+
+    PYTHONPATH=. python benchmarks/bench_local_layout.py [count]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from flask_cloudy import Storage
+
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def bench(name, storage, names, generic=False):
+    data = b"x" * 100
+    driver = storage.driver
+    container = storage.container
+
+    if generic:
+        write = timed(lambda: [container.upload_object_via_stream(iter([data]), n) for n in names])
+
+        def _contains(n):
+            try:
+                driver.get_object(container.name, n)
+                return True
+            except Exception:
+                return False
+        contains = timed(lambda: [_contains(n) for n in names])
+        get = timed(lambda: [container.get_object(n) for n in names])
+        count = timed(lambda: len(container.list_objects()))
+    else:
+        write = timed(lambda: [storage._put_object(n, iterator=iter([data])) for n in names])
+        contains = timed(lambda: [n in storage for n in names])
+        get = timed(lambda: [storage.get(n) for n in names])
+        count = timed(lambda: len(storage))
+    listing = timed(lambda: sum(1 for _ in storage))
+    print("%-16s write %7.2fs   in %7.2fs   get %7.2fs   len %7.2fs   iterate %7.2fs"
+          % (name, write, contains, get, count, listing))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    names = ["object-%s.txt" % i for i in range(count)]
+    for name, kwargs, generic in [("flat (libcloud)", {}, True),
+                                  ("flat", {}, False),
+                                  ("sharded (1)", {"local_shards": 1}, False),
+                                  ("sharded (2)", {"local_shards": 2}, False)]:
+        path = tempfile.mkdtemp()
+        try:
+            bench(name, Storage(provider="LOCAL", container=path, **kwargs), names, generic)
+        finally:
+            shutil.rmtree(path)
+            # Don't let the write back of a layout slow down the next one
+            os.sync()
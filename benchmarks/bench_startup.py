@@ -0,0 +1,61 @@
+"""
+Startup: the time to import flask_cloudy, and the time of `init_app`
+and of the first use of the storage, with a provider answering in `latency` seconds
+
+    PYTHONPATH=. python benchmarks/bench_startup.py [latency]
+"""
+
+import sys
+import time
+import subprocess
+from flask import Flask
+
+
+def import_time(runs=10):
+    code = "import time; t = time.time(); import flask_cloudy; print(time.time() - t)"
+    times = sorted(float(subprocess.check_output([sys.executable, "-c", code]))
+                   for _ in range(runs))
+    return times[len(times) // 2]
+
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def slow_provider(latency):
+    """
+    Make the S3 driver answer `get_container` after `latency` seconds, without network
+    """
+    from libcloud.storage.base import Container
+    from libcloud.storage.drivers.s3 import S3StorageDriver
+
+    def get_container(self, container_name):
+        time.sleep(latency)
+        return Container(name=container_name, extra={}, driver=self)
+    S3StorageDriver.get_container = get_container
+
+
+def bench(name, latency, **config):
+    from flask_cloudy import Storage
+
+    app = Flask(__name__)
+    app.config.update(STORAGE_PROVIDER="S3",
+                      STORAGE_KEY="key",
+                      STORAGE_SECRET="secret",
+                      STORAGE_CONTAINER="bucket",
+                      **config)
+    storage = Storage()
+    init = timed(lambda: storage.init_app(app))
+    time.sleep(latency * 2)  # the app serving its first request
+    first = timed(lambda: storage.container)
+    print("%-10s init_app %7.3fs   first use %7.3fs" % (name, init, first))
+
+
+if __name__ == "__main__":
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    print("import     %7.3fs" % import_time())
+    slow_provider(latency)
+    bench("lazy", latency)
+    bench("warmup", latency, STORAGE_WARMUP=True)
@@ -0,0 +1,47 @@
+"""
+Integrity check of a LOCAL container: `save_to` and hash every object one after
+another, against Storage.verify with 1 and 4 workers
+
+    PYTHONPATH=. python benchmarks/bench_verify.py [count] [size]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from flask_cloudy import Storage, get_file_md5
+
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def save_all(storage, directory):
+    for obj in storage:
+        path = storage.get(obj.name).save_to(directory, overwrite=True)
+        get_file_md5(path)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 4 * 1024 * 1024
+    path = tempfile.mkdtemp()
+    try:
+        container = os.path.join(path, "container")
+        downloads = os.path.join(path, "downloads")
+        os.mkdir(container)
+        os.mkdir(downloads)
+        data = os.urandom(size)
+        for i in range(count):
+            with open(os.path.join(container, "object-%s.bin" % i), "wb") as f:
+                f.write(data)
+        storage = Storage(provider="LOCAL", container=container)
+
+        print("save_to + md5   %7.2fs" % timed(lambda: save_all(storage, downloads)))
+        for workers in (1, 4):
+            print("verify (%s)      %7.2fs" % (workers, timed(lambda: storage.verify(workers=workers))))
+    finally:
+        shutil.rmtree(path)
@@ -5,29 +5,48 @@ Flask-Cloudy
 import os
 import re
 import datetime
+import calendar
 import base64
 import hmac
 import hashlib
+import time
 import warnings
+import threading
+from collections import OrderedDict
 from contextlib import contextmanager
 import copy
+import json
+import shutil
+import stat as stat_lib
+from mimetypes import guess_type
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 from importlib import import_module
-from flask import send_file, abort, url_for
+from flask import send_file, abort, url_for, redirect, Response
 from flask import request as flask_request
 import uuid
-from libcloud.storage.types import Provider, ObjectDoesNotExistError
-from libcloud.storage.providers import DRIVERS, get_driver
-from libcloud.storage.base import Object as BaseObject, StorageDriver
-from libcloud.storage.drivers import local
-from six.moves.urllib.parse import urlparse, urlunparse, urljoin, urlencode
-from six.moves.urllib import request
-from six import string_types
-import slugify
+from urllib.parse import urlparse, urlunparse, urljoin, urlencode
+from urllib import request
+import queue
 
 
 SERVER_ENDPOINT = "FLASK_CLOUDY_SERVER"
+ARCHIVE_SERVER_ENDPOINT = "FLASK_CLOUDY_ARCHIVE_SERVER"
+UPLOAD_SERVER_ENDPOINT = "FLASK_CLOUDY_UPLOAD_SERVER"
+
+# The version of the tus protocol the resumable upload server follows
+TUS_VERSION = "1.0.0"
+
+CHUNK_SIZE = 64 * 1024
+
+# Suffix of the files being written on LOCAL, before they are renamed
+TMP_SUFFIX = ".cloudy-tmp"
+
+ARCHIVE_FORMATS = {
+    "zip": "application/zip",
+    "tar": "application/x-tar",
+    "tar.gz": "application/gzip"
+}
 
 EXTENSIONS = {
     "TEXT": ["txt", "md"],
@@ -48,9 +67,26 @@ ALL_EXTENSIONS = EXTENSIONS["TEXT"] \
 
 URL_REGEXP = re.compile(r'^(http|https|ftp|ftps)://')
 
+MD5_REGEXP = re.compile(r'^[0-9a-f]{32}$')
+
 class InvalidExtensionError(Exception):
     pass
 
+class InvalidSizeError(Exception):
+    pass
+
+class InvalidMimeTypeError(Exception):
+    pass
+
+class ReplicationError(Exception):
+    """
+    Raised when an upload didn't reach the write quorum
+    `errors` holds the exception of each failed storage
+    """
+    def __init__(self, message, errors=None):
+        super(ReplicationError, self).__init__(message)
+        self.errors = errors or {}
+
 def get_file_name(filename):
     """
     Return the filename without the path
@@ -86,6 +122,9 @@ def get_driver_class(provider):
     :param provider: str - provider name
     :return:
     """
+    from libcloud.storage.types import Provider
+    from libcloud.storage.providers import get_driver
+
     if "." in provider:
         parts = provider.split('.')
         kls = parts.pop()
@@ -95,10 +134,9 @@ def get_driver_class(provider):
             raise ImportError('{0} provider not found at {1}'.format(
                 kls,
                 path))
-        driver = getattr(module, kls)
-    else:
-        driver = getattr(Provider, provider.upper())
-    return get_driver(driver)
+        # A driver class, libcloud only looks up its own providers
+        return getattr(module, kls)
+    return get_driver(getattr(Provider, provider.upper()))
 
 def get_provider_name(driver):
     """
@@ -106,16 +144,995 @@ def get_provider_name(driver):
     :param driver: obj
     :return: str
     """
-    kls = driver.__class__.__name__
-    for d, prop in DRIVERS.items():
-        if prop[1] == kls:
-            return d
+    from libcloud.storage.providers import DRIVERS
+
+    for kls in type(driver).__mro__:
+        for d, prop in DRIVERS.items():
+            if prop[1] == kls.__name__:
+                return d
     return None
 
+def get_mtime(extra):
+    """
+    Return the modification time from the extra of a driver object
+    :param extra: dict
+    :return: float - timestamp, or None
+    """
+    if not extra:
+        return None
+    return parse_mtime(extra.get("modify_time") or extra.get("last_modified"))
+
+def parse_mtime(mtime):
+    """
+    Return the timestamp of a modification time, as found in the drivers extra
+    :param mtime: float or str
+    :return: float - timestamp, or None
+    """
+    if isinstance(mtime, (int, float)):
+        return float(mtime)
+    if isinstance(mtime, str):
+        # ISO 8601 in listings, ie: 2017-01-01T00:00:00.000Z
+        if len(mtime) >= 19 and mtime[10] == "T":
+            try:
+                return float(calendar.timegm((int(mtime[0:4]), int(mtime[5:7]), int(mtime[8:10]),
+                                              int(mtime[11:13]), int(mtime[14:16]), int(mtime[17:19]))))
+            except ValueError:
+                return None
+        # RFC 1123 in headers, ie: Sun, 01 Jan 2017 00:00:00 GMT
+        import email.utils
+        parsed = email.utils.parsedate_tz(mtime)
+        if parsed:
+            return float(email.utils.mktime_tz(parsed))
+    return None
+
+def scandir_files(path):
+    """
+    Recursively iterate over the files of a local directory,
+    skipping the files being written and the lock directories
+    :param path: str
+    :return: generator of os.DirEntry
+    """
+    from libcloud.storage.drivers.local import IGNORE_FOLDERS
+
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name not in IGNORE_FOLDERS:
+                for sub_entry in scandir_files(entry.path):
+                    yield sub_entry
+        elif not entry.name.endswith(TMP_SUFFIX):
+            yield entry
+
+def _make_local_object(driver, container, object_name, stat):
+    """
+    Create the same object as the LOCAL driver, from a stat result
+    :return: libcloud.storage.base.Object
+    """
+    from libcloud.storage.base import Object as BaseObject
+
+    # The LOCAL driver hashes the mtime, the file system changes it with the content
+    data_hash = hashlib.md5(str(stat.st_mtime).encode("ascii")).hexdigest()
+    extra = {
+        "creation_time": stat.st_ctime,
+        "access_time": stat.st_atime,
+        "modify_time": stat.st_mtime
+    }
+    return BaseObject(name=object_name,
+                      size=stat.st_size,
+                      hash=data_hash,
+                      extra=extra,
+                      meta_data=None,
+                      container=container,
+                      driver=driver)
+
+def get_file_md5(filename, chunk_size=CHUNK_SIZE):
+    """
+    Return the md5 hex digest of a local file
+    :param filename:
+    :param chunk_size: int
+    :return: str
+    """
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def run_parallel(func, items, workers=4):
+    """
+    Run func on each item with a pool of threads.
+    Items are pulled lazily, so it can be a generator
+    :param func: callable
+    :param items: iterable
+    :param workers: int - number of threads
+    :return: list of (item, result, exception) in the order of completion
+    """
+    items = iter(items)
+    lock = threading.Lock()
+    results = []
+
+    def _worker():
+        while True:
+            with lock:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            try:
+                results.append((item, func(item), None))
+            except Exception as e:
+                results.append((item, None, e))
+
+    threads = [threading.Thread(target=_worker) for _ in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls by key: while a call is in flight, the other
+    callers with the same key wait for it and share its result (or exception),
+    instead of calling the provider again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Call func, or wait for the call in flight with the same key
+        :param key: hashable
+        :param func: callable
+        :return: the result of func
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"event": threading.Event()}
+
+        if not leader:
+            call["event"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = func(*args, **kwargs)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["event"].set()
+
+
+# Shared by all the storages, the keys hold the container
+_flights = SingleFlight()
+
+
+class Throttle(object):
+    """
+    Limit the bandwidth, with a token bucket of `rate` bytes per second,
+    and the number of concurrent operations.
+    The time spent queueing for a slot or for bandwidth is in `metrics`
+    """
+
+    def __init__(self, rate=None, concurrency=None, burst=None):
+        """
+        :param rate: int - bytes per second. None for no limit
+        :param concurrency: int - concurrent operations. None for no limit
+        :param burst: int - bytes that can go at once. Default to a second of `rate`
+        """
+        self.rate = rate
+        self.concurrency = concurrency
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(concurrency) if concurrency else None
+        self._metrics = {
+            "operations": 0,
+            "active": 0,
+            "queued": 0,
+            "queued_time": 0.0,
+            "throttled_time": 0.0,
+            "bytes": 0
+        }
+
+    @property
+    def metrics(self):
+        """
+        - operations: operations started
+        - active: operations running
+        - queued: operations waiting for a slot
+        - queued_time: total seconds waited for a slot
+        - throttled_time: total seconds waited for bandwidth
+        - bytes: bytes transferred
+        :return: dict
+        """
+        with self._lock:
+            return dict(self._metrics)
+
+    def acquire(self):
+        """
+        Wait for a slot to start an operation
+        """
+        start = time.time()
+        with self._lock:
+            self._metrics["queued"] += 1
+        if self._slots is not None:
+            self._slots.acquire()
+        with self._lock:
+            self._metrics["queued"] -= 1
+            self._metrics["queued_time"] += time.time() - start
+            self._metrics["active"] += 1
+            self._metrics["operations"] += 1
+
+    def release(self):
+        """
+        Release the slot of an operation
+        """
+        with self._lock:
+            self._metrics["active"] -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def consume(self, size):
+        """
+        Take `size` bytes from the bucket, waiting until they are available
+        :param size: int
+        """
+        wait = 0
+        with self._lock:
+            self._metrics["bytes"] += size
+            if self.rate:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # The tokens are taken right away, so the waiting callers are served in order
+                self._tokens -= size
+                if self._tokens < 0:
+                    wait = -self._tokens / float(self.rate)
+                    self._metrics["throttled_time"] += wait
+        if wait:
+            time.sleep(wait)
+
+
+class ThrottleGroup(object):
+    """
+    A Throttle per key, ie: per tenant, created on first use with the same limits
+    """
+
+    def __init__(self, rate=None, concurrency=None, burst=None):
+        """
+        :params: the limits of each Throttle
+        """
+        self._kwargs = {"rate": rate, "concurrency": concurrency, "burst": burst}
+        self._throttles = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._throttles)
+
+    def get(self, key):
+        """
+        Return the Throttle of a key
+        :param key: str
+        :return: Throttle
+        """
+        with self._lock:
+            if key not in self._throttles:
+                self._throttles[key] = Throttle(**self._kwargs)
+            return self._throttles[key]
+
+    @property
+    def metrics(self):
+        """
+        The metrics of each key
+        :return: dict
+        """
+        with self._lock:
+            throttles = list(self._throttles.items())
+        return dict((key, throttle.metrics) for key, throttle in throttles)
+
+
+@contextmanager
+def throttle_slots(throttles):
+    """
+    Hold a slot in all the throttles for an operation.
+    The most specific ones (last) are acquired first, so an operation waiting
+    for its own slot doesn't hold a slot shared with other callers
+    :param throttles: list of Throttle
+    """
+    acquired = []
+    try:
+        for throttle in reversed(throttles):
+            throttle.acquire()
+            acquired.append(throttle)
+        yield
+    finally:
+        for throttle in reversed(acquired):
+            throttle.release()
+
+def throttle_iterator(iterator, throttles):
+    """
+    Pass the chunks of an iterator through the bandwidth limits of the throttles
+    :param iterator: iterator of bytes
+    :param throttles: list of Throttle
+    :return: generator
+    """
+    for chunk in iterator:
+        throttle_consume(throttles, len(chunk))
+        yield chunk
+
+def throttle_consume(throttles, size):
+    """
+    Take `size` bytes from the bandwidth of all the throttles
+    :param throttles: list of Throttle
+    :param size: int
+    """
+    for throttle in reversed(throttles):
+        throttle.consume(size)
+
+def iterate_file(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Iterate over the content of a file, by chunks
+    :param file_path: str
+    :return: generator of bytes
+    """
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+
+def get_file_md5_mmap(filename, throttles=(), chunk_size=1024 * 1024):
+    """
+    Return the md5 hex digest and the size of a local file, mapped in memory.
+    The file isn't copied, and hashing releases the GIL, so files can be hashed in parallel threads
+    :param filename: str
+    :param throttles: list of Throttle - to limit the read bandwidth
+    :param chunk_size: int
+    :return: tuple (str, int)
+    """
+    import mmap
+
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        # An empty file can't be mapped
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, memoryview(m) as view:
+                for offset in range(0, size, chunk_size):
+                    with view[offset:offset + chunk_size] as chunk:
+                        throttle_consume(throttles, len(chunk))
+                        md5.update(chunk)
+    return md5.hexdigest(), size
+
+def get_object_md5(driver, obj, throttles=(), range_size=8 * 1024 * 1024, retries=2):
+    """
+    Return the md5 hex digest and the size of a remote object, streamed by ranges.
+    A range that fails is read again, instead of the whole object
+    :param driver: libcloud.storage.base.StorageDriver
+    :param obj: libcloud.storage.base.Object
+    :param throttles: list of Throttle - to limit the read bandwidth
+    :param range_size: int
+    :param retries: int - attempts of a range that fails
+    :return: tuple (str, int)
+    """
+    md5 = hashlib.md5()
+    size = 0
+    if obj.size == 0:
+        # A range request on an empty object is unsatisfiable
+        return md5.hexdigest(), size
+    while True:
+        # The last range goes to the end, wherever it is
+        end = size + range_size if obj.size and size + range_size < obj.size else None
+        for attempt in range(retries + 1):
+            range_md5 = md5.copy()
+            read = 0
+            try:
+                stream = driver.download_object_range_as_stream(obj, size, end, CHUNK_SIZE)
+                for chunk in throttle_iterator(stream, throttles):
+                    range_md5.update(chunk)
+                    read += len(chunk)
+                break
+            except NotImplementedError:
+                if size:
+                    raise
+                # The driver has no range requests
+                stream = driver.download_object_as_stream(obj, CHUNK_SIZE)
+                for chunk in throttle_iterator(stream, throttles):
+                    md5.update(chunk)
+                    size += len(chunk)
+                return md5.hexdigest(), size
+            except Exception:
+                if attempt == retries:
+                    raise
+        md5 = range_md5
+        size += read
+        if end is None or size < end:
+            return md5.hexdigest(), size
+
+
+class LocalCache(object):
+    """
+    A size-bounded LRU cache of objects on the local disk.
+    It sits in front of a remote provider as a read-through cache, so hot
+    objects are read from the local disk instead of the provider.
+
+    Cached files are keyed by container, name and hash (ETag), so an object
+    that changed on the provider gets a new entry and the stale one is evicted.
+    Only the files named after a key are managed, other files in the directory are left alone.
+    """
+
+    # sha1 of the key, and the extension of the object
+    KEY_REGEXP = re.compile(r'^[0-9a-f]{40}(\.[^.]+)?$')
+    # a download in progress, a dot, the key and a uuid
+    PARTIAL_REGEXP = re.compile(r'^\.[0-9a-f]{40}(\.[^.]+)?\.[0-9a-f]{32}$')
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        """
+        :param directory: str - the directory to hold the cached files
+        :param max_size: int - the max total size in bytes of the cached files
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        """
+        Pick up the files left by a previous process, oldest first
+        """
+        files = []
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            stat = os.lstat(path)
+            if not stat_lib.S_ISREG(stat.st_mode):
+                continue
+            if re.match(self.PARTIAL_REGEXP, entry):
+                os.remove(path)
+            elif re.match(self.KEY_REGEXP, entry):
+                files.append((stat.st_mtime, entry, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self.size += size
+        self._evict()
+
+    def _key(self, obj):
+        """
+        Return the cache key of the object
+        :param obj: Object
+        :return: str
+        """
+        key = "%s/%s:%s" % (obj.container.name, obj.name, obj.hash or "")
+        key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        extension = get_file_extension(obj.name)
+        return "%s.%s" % (key, extension) if extension else key
+
+    def _evict(self):
+        while self.size > self.max_size and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.size -= size
+            path = os.path.join(self.directory, key)
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def __contains__(self, obj):
+        return self._key(obj) in self._entries
+
+    def get_path(self, obj):
+        """
+        Return the path of the cached object, downloading it on a miss
+        :param obj: Object
+        :return: str or None if the object can't fit in the cache
+        """
+        if obj.size and obj.size > self.max_size:
+            return None
+
+        key = self._key(obj)
+        path = os.path.join(self.directory, key)
+        with self._lock:
+            if key in self._entries:
+                if os.path.isfile(path):
+                    self._entries[key] = self._entries.pop(key)
+                    return path
+                self.size -= self._entries.pop(key)
+
+        # A single download per object, the concurrent misses wait for it
+        return _flights.do(("cache", self.directory, key), self._fill, obj, key, path)
+
+    def _fill(self, obj, key, path):
+        """
+        Download the object into the cache
+        :return: str or None
+        """
+        tmp_path = os.path.join(self.directory, ".%s.%s" % (key, uuid.uuid4().hex))
+        try:
+            if not obj.download(tmp_path, overwrite_existing=True):
+                return None
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+        size = os.path.getsize(path)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = size
+                self.size += size
+            self._evict()
+        return path if os.path.isfile(path) else None
+
+    def clear(self):
+        """
+        Remove all the cached files
+        """
+        with self._lock:
+            for key in self._entries:
+                path = os.path.join(self.directory, key)
+                if os.path.isfile(path):
+                    os.remove(path)
+            self._entries.clear()
+            self.size = 0
+
+
+class JournalSink(object):
+    """
+    An event sink that appends the events to a local file, a json object per line.
+    Consumers read it from the offset where they stopped, with `read(offset)`
+    """
+
+    def __init__(self, path, fsync=False):
+        """
+        :param path: str - the journal file
+        :param fsync: bool - to sync each event to disk
+        """
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        line = (json.dumps(event, sort_keys=True) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self.path, "ab") as f:
+                f.write(line)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def read(self, offset=0):
+        """
+        Read the events from an offset
+        :param offset: int - 0, or an offset returned with a previous event
+        :return: generator of (event, offset of the next event)
+        """
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                # The last line may be being written
+                if not line.endswith(b"\n"):
+                    return
+                offset += len(line)
+                yield json.loads(line.decode("utf-8")), offset
+
+
+class WebhookSink(object):
+    """
+    An event sink that posts the events to a url in batches (a json list), from a
+    background thread. A batch that fails is retried, then dropped with a warning
+    """
+
+    def __init__(self, url, batch_size=100, interval=1.0, retries=3, timeout=10, max_queue=10000, send=None):
+        """
+        :param url: str
+        :param batch_size: int - max events per post
+        :param interval: float - max seconds an event waits for its batch to fill
+        :param retries: int - attempts of a batch that fails
+        :param timeout: int - seconds of a post
+        :param max_queue: int - events waiting to be sent. Over it, they are dropped
+        :param send: callable(url, batch) - to send a batch instead of posting it, ie: WebhookStub
+        """
+        self.url = url
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retries = retries
+        self.timeout = timeout
+        self.sent = 0
+        self.dropped = 0
+        self._send = send or self._post
+        self._queue = queue.Queue(max_queue)
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def __call__(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """
+        Wait until the queued events are sent, or dropped
+        """
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            self._dispatch(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _dispatch(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                self._send(self.url, batch)
+                self.sent += len(batch)
+                return
+            except Exception as e:
+                error = e
+                time.sleep(min(0.1 * 2 ** attempt, 5))
+        self.dropped += len(batch)
+        warnings.warn("Flask-Cloudy dropped %s events for '%s': %s" % (len(batch), self.url, error))
+
+    def _post(self, url, batch):
+        req = request.Request(url,
+                              data=json.dumps(batch).encode("utf-8"),
+                              headers={"Content-Type": "application/json"})
+        response = request.urlopen(req, timeout=self.timeout)
+        try:
+            response.read()
+        finally:
+            response.close()
+
+
+class WebhookStub(object):
+    """
+    A local stand in for a webhook endpoint, to use as the `send` of a WebhookSink
+    in development and tests. It keeps the batches it receives
+    """
+
+    def __init__(self, failures=0):
+        """
+        :param failures: int - the number of calls that fail first
+        """
+        self.failures = failures
+        self.batches = []
+
+    def __call__(self, url, batch):
+        if self.failures:
+            self.failures -= 1
+            raise IOError("Webhook stub failure")
+        self.batches.append(batch)
+
+    @property
+    def events(self):
+        return [event for batch in self.batches for event in batch]
+
+
+class ObjectIndex(object):
+    """
+    A SQLite index of the objects metadata, to query objects without listing
+    the whole container. It's maintained by the Storage mutating methods,
+    and can be rebuilt with `Storage.reindex()`
+    """
+
+    COLUMNS = ("name", "prefix", "extension", "type", "size", "hash", "mtime", "meta_data")
+    ORDER_BY = ("name", "size", "mtime")
+
+    def __init__(self, path=":memory:"):
+        """
+        :param path: str - the SQLite database file
+        """
+        import sqlite3
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS objects ("
+                             "container TEXT NOT NULL, name TEXT NOT NULL, prefix TEXT, "
+                             "extension TEXT, type TEXT, size INTEGER, hash TEXT, "
+                             "mtime REAL, meta_data TEXT, PRIMARY KEY (container, name))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS objects_type "
+                             "ON objects (container, type, size)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS objects_prefix "
+                             "ON objects (container, prefix)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS objects_mtime "
+                             "ON objects (container, mtime)")
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+
+    def _row(self, container, obj, mtime=None):
+        """
+        :param mtime: float - the modification time when the object has none
+        """
+        name = obj.name
+        prefix = name.rsplit("/", 1)[0] + "/" if "/" in name else ""
+        meta_data = getattr(obj, "meta_data", None)
+        return (container,
+                name,
+                prefix,
+                get_file_extension(name),
+                get_file_extension_type(name),
+                obj.size,
+                obj.hash,
+                get_mtime(getattr(obj, "extra", None)) or mtime,
+                json.dumps(meta_data) if meta_data else None)
+
+    def add(self, container, objects):
+        """
+        Add or update objects, as they were just written. The objects returned by
+        some uploads have no modification time (ie: S3), the time they are added is used
+        :param container: str - the container key
+        :param objects: list of objects
+        """
+        now = time.time()
+        rows = [self._row(container, obj, mtime=now) for obj in objects]
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO objects (container, %s) VALUES (?%s)"
+                                 % (", ".join(self.COLUMNS), ", ?" * len(self.COLUMNS)), rows)
+
+    def remove(self, container, object_names):
+        """
+        Remove objects
+        :param container: str - the container key
+        :param object_names: list of str
+        """
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM objects WHERE container = ? AND name = ?",
+                                 [(container, name) for name in object_names])
+
+    def rebuild(self, container, objects, batch_size=1000):
+        """
+        Replace all the objects of a container
+        :param container: str - the container key
+        :param objects: iterable of objects, ie: a listing
+        :return: int - the number of objects indexed
+        """
+        count = 0
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM objects WHERE container = ?", (container,))
+            batch = []
+            for obj in objects:
+                batch.append(self._row(container, obj))
+                if len(batch) >= batch_size:
+                    count += self._insert(batch)
+                    batch = []
+            count += self._insert(batch)
+        return count
+
+    def _insert(self, rows):
+        self._db.executemany("INSERT OR REPLACE INTO objects (container, %s) VALUES (?%s)"
+                             % (", ".join(self.COLUMNS), ", ?" * len(self.COLUMNS)), rows)
+        return len(rows)
+
+    def query(self,
+              container,
+              prefix=None,
+              type=None,
+              extension=None,
+              min_size=None,
+              max_size=None,
+              order_by="name",
+              desc=False,
+              limit=None):
+        """
+        Return the indexed objects matching all the filters
+        :param container: str - the container key
+        :param prefix: str - the objects names start with it
+        :param type: str - the group of the extension, ie: IMAGE
+        :param extension: str
+        :param min_size: int - in bytes
+        :param max_size: int - in bytes
+        :param order_by: str - name, size or mtime
+        :param desc: bool - To sort in descending order
+        :param limit: int
+        :return: list of dict
+        """
+        if order_by not in self.ORDER_BY:
+            raise ValueError("Invalid order_by: '%s'" % order_by)
+        where = ["container = ?"]
+        params = [container]
+        if prefix:
+            # A range on the primary key, instead of a LIKE
+            where.append("name >= ? AND name < ?")
+            params.extend([prefix, prefix + u"\U0010ffff"])
+        if type:
+            where.append("type = ?")
+            params.append(type.upper())
+        if extension:
+            where.append("extension = ?")
+            params.append(extension.lower())
+        if min_size is not None:
+            where.append("size >= ?")
+            params.append(min_size)
+        if max_size is not None:
+            where.append("size <= ?")
+            params.append(max_size)
+        sql = "SELECT %s FROM objects WHERE %s ORDER BY %s %s" \
+              % (", ".join(self.COLUMNS), " AND ".join(where), order_by, "DESC" if desc else "ASC")
+        if limit:
+            sql += " LIMIT %d" % int(limit)
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        results = []
+        for row in rows:
+            result = dict(zip(self.COLUMNS, row))
+            result["meta_data"] = json.loads(result["meta_data"]) if result["meta_data"] else None
+            results.append(result)
+        return results
+
+
+class ShardedLocalMixin(object):
+    """
+    A LOCAL driver that spreads the objects in hash based sub directories,
+    ie: `my/object.txt` is stored at `3f/my/object.txt`, so directories
+    stay small with many objects. Object names are not changed.
+    Writes go to a temp file which is renamed, so they are atomic and lock free.
+    It's mixed in the libcloud LOCAL driver by `get_sharded_driver_class()`
+    """
+
+    def __init__(self, key, shard_depth=1, **kwargs):
+        """
+        :param key: str - the base path
+        :param shard_depth: int - the levels of sub directories (256 per level)
+        """
+        self.shard_depth = shard_depth
+        super(ShardedLocalMixin, self).__init__(key, **kwargs)
+
+    def get_object_path(self, container, object_name):
+        """
+        Return the path of the object on disk
+        :param container: Container
+        :param object_name: str
+        :return: str
+        """
+        digest = hashlib.md5(object_name.encode("utf-8")).hexdigest()
+        shards = [digest[i * 2:i * 2 + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.base_path, container.name, *(shards + [object_name]))
+
+    def get_object_cdn_url(self, obj):
+        return self.get_object_path(obj.container, obj.name)
+
+    def _make_object(self, container, object_name):
+        from libcloud.storage.types import ObjectDoesNotExistError
+
+        try:
+            stat = os.stat(self.get_object_path(container, object_name))
+        except OSError:
+            stat = None
+        if stat is None or not stat_lib.S_ISREG(stat.st_mode):
+            raise ObjectDoesNotExistError(value=None, driver=self, object_name=object_name)
+        return _make_local_object(self, container, object_name, stat)
+
+    def _get_objects(self, container):
+        cpath = self.get_container_cdn_url(container, check=True)
+        for entry in scandir_files(cpath):
+            parts = os.path.relpath(entry.path, cpath).split(os.sep)
+            if len(parts) > self.shard_depth:
+                object_name = "/".join(parts[self.shard_depth:])
+                yield _make_local_object(self, container, object_name, entry.stat())
+
+    def upload_object(self,
+                      file_path,
+                      container,
+                      object_name,
+                      extra=None,
+                      verify_hash=True,
+                      headers=None):
+        return self._write_object(container, object_name,
+                                  lambda tmp_path: shutil.copyfile(file_path, tmp_path))
+
+    def upload_object_via_stream(self, iterator, container, object_name, extra=None, headers=None):
+        def _write(tmp_path):
+            with open(tmp_path, "wb") as f:
+                for data in iterator:
+                    f.write(data)
+        return self._write_object(container, object_name, _write)
+
+    def delete_object(self, obj):
+        path = self.get_object_cdn_url(obj)
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+
+        # Delete the empty parent directories, up to the container
+        container_path = os.path.normpath(obj.container.get_cdn_url())
+        path = os.path.dirname(path)
+        while path != container_path and path.startswith(container_path):
+            try:
+                os.rmdir(path)
+            except OSError:
+                break
+            path = os.path.dirname(path)
+        return True
+
+    def _write_object(self, container, object_name, write):
+        """
+        Write the object to a temp file, then rename it
+        :param write: callable - receives the temp file path
+        :return: Object
+        """
+        self.get_container_cdn_url(container, check=True)
+        obj_path = self.get_object_path(container, object_name)
+        self._make_path(os.path.dirname(obj_path))
+        tmp_path = "%s.%s%s" % (obj_path, uuid.uuid4().hex, TMP_SUFFIX)
+        try:
+            write(tmp_path)
+            os.chmod(tmp_path, int("664", 8))
+            os.rename(tmp_path, obj_path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+        return self._make_object(container, object_name)
+
+
+_sharded_driver_class = None
+_sharded_driver_lock = threading.Lock()
+
+def get_sharded_driver_class():
+    """
+    Return the ShardedLocalStorageDriver class. It's created on first use,
+    so libcloud is only imported when a storage needs it
+    :return: class
+    """
+    global _sharded_driver_class
+    with _sharded_driver_lock:
+        if _sharded_driver_class is None:
+            from libcloud.storage.drivers import local
+            _sharded_driver_class = type("ShardedLocalStorageDriver",
+                                         (ShardedLocalMixin, local.LocalStorageDriver),
+                                         {"__module__": __name__,
+                                          "__doc__": ShardedLocalMixin.__doc__})
+    return _sharded_driver_class
+
+def __getattr__(name):
+    """
+    Module attributes created on first use, ie:
+    `from flask_cloudy import ShardedLocalStorageDriver`
+    """
+    if name == "ShardedLocalStorageDriver":
+        return get_sharded_driver_class()
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
 
 class Storage(object):
-    container = None
-    driver = None
+    cache = None
+    index = None
+    uploads = None
+    events = ()
+    throttles = ()
+    throttle_group = None
     config = {}
 
     TEXT = EXTENSIONS["TEXT"]
@@ -127,8 +1144,14 @@ class Storage(object):
     ARCHIVE = EXTENSIONS["ARCHIVE"]
 
     allowed_extensions = TEXT + DOCUMENT + IMAGE + AUDIO + DATA
+    allowed_mimetypes = None
+    max_size = None
 
     _kw = {}
+    _driver = None
+    _driver_factory = None
+    _container = None
+    _container_name = None
 
     def __init__(self,
                  provider=None,
@@ -137,6 +1160,15 @@ class Storage(object):
                  container=None,
                  allowed_extensions=None,
                  app=None,
+                 cache=None,
+                 max_size=None,
+                 allowed_mimetypes=None,
+                 local_shards=None,
+                 index=None,
+                 warmup=False,
+                 throttle=None,
+                 throttle_group=None,
+                 events=None,
                  **kwargs):
 
         """
@@ -147,6 +1179,18 @@ class Storage(object):
         :param container: str - the name of the container (bucket or a dir name if local)
         :param allowed_extensions: list - extensions allowed for upload
         :param app: object - Flask instance
+        :param cache: LocalCache - a local cache to read remote objects from
+        :param max_size: int - max size in bytes of the uploads
+        :param allowed_mimetypes: list - mimetypes allowed for upload, ie: image/png or image/*
+        :param local_shards: int - for LOCAL, the levels of hash based sub directories to store
+                the objects in. Use it for containers with many objects
+        :param index: ObjectIndex - an index of the objects metadata, for `query`
+        :param warmup: bool - to resolve the driver and the container in the background.
+                By default they are resolved on first use
+        :param throttle: Throttle - the bandwidth and concurrency limits of the uploads and downloads
+        :param throttle_group: ThrottleGroup - the limits per key, for `throttled(key)`
+        :param events: list - the sinks of the change events: callables receiving each event,
+                ie: JournalSink, WebhookSink
         :param kwargs: any other params will pass to the provider initialization
         :return:
         """
@@ -162,10 +1206,27 @@ class Storage(object):
                 "secret": secret,
                 "container": container,
                 "allowed_extensions": allowed_extensions,
-                "app": app
+                "app": app,
+                "cache": cache,
+                "max_size": max_size,
+                "allowed_mimetypes": allowed_mimetypes,
+                "local_shards": local_shards,
+                "index": index,
+                "throttle": throttle,
+                "throttle_group": throttle_group,
+                "events": events
             }
             self._kw.update(kwargs)
 
+            self.cache = cache
+            self.index = index
+            self.max_size = max_size
+            self.throttles = (throttle,) if throttle is not None else ()
+            self.throttle_group = throttle_group
+            self.events = list(events or [])
+            if allowed_mimetypes:
+                self.allowed_mimetypes = allowed_mimetypes
+
             if allowed_extensions:
                 self.allowed_extensions = allowed_extensions
 
@@ -180,11 +1241,73 @@ class Storage(object):
 
             kwparams.update(kwargs)
 
-            self.driver = get_driver_class(provider)(**kwparams)
-            if not isinstance(self.driver, StorageDriver):
-                raise AttributeError("Invalid Driver")
+            def create_driver():
+                from libcloud.storage.base import StorageDriver
+
+                if local_shards and provider.upper() == "LOCAL":
+                    driver = get_sharded_driver_class()(shard_depth=local_shards, **kwparams)
+                else:
+                    driver = get_driver_class(provider)(**kwparams)
+                if not isinstance(driver, StorageDriver):
+                    raise AttributeError("Invalid Driver")
+                return driver
+
+            # The driver and the container are resolved on first use,
+            # so the startup doesn't import the drivers nor wait for the provider
+            self._lock = threading.RLock()
+            self._driver = None
+            self._driver_factory = create_driver
+            self._container = None
+            self._container_name = container
+
+            if warmup:
+                self.warmup()
+
+    @property
+    def driver(self):
+        """
+        The libcloud driver, created on first use
+        :return: libcloud.storage.base.StorageDriver
+        """
+        if self._driver is None and self._driver_factory is not None:
+            with self._lock:
+                if self._driver is None:
+                    self._driver = self._driver_factory()
+        return self._driver
+
+    @property
+    def container(self):
+        """
+        The container, resolved on first use. On cloud providers it's a network call
+        :return: libcloud.storage.base.Container
+        """
+        if self._container is None and self._driver_factory is not None:
+            with self._lock:
+                if self._container is None:
+                    self._container = self.driver.get_container(self._container_name)
+        return self._container
 
-            self.container = self.driver.get_container(container)
+    def warmup(self, background=True):
+        """
+        Resolve the driver and the container ahead of their first use
+        :param background: bool - to do it in a daemon thread, so the startup doesn't
+                wait for the provider. On failure, the first use will retry it
+        :return: threading.Thread, or None if not in the background
+        """
+        if not background:
+            self.container
+            return None
+
+        def _warmup():
+            try:
+                self.container
+            except Exception as e:
+                warnings.warn("Flask-Cloudy can't warm up the storage: %s" % e)
+
+        thread = threading.Thread(target=_warmup)
+        thread.daemon = True
+        thread.start()
+        return thread
 
     def __iter__(self):
         """
@@ -192,8 +1315,11 @@ class Storage(object):
         Iterate over all the objects in the container
         :return: generator
         """
-        for obj in self.container.iterate_objects():
-            yield Object(obj=obj)
+        kwargs = {"storage": self}
+        if self.throttles:
+            kwargs["throttles"] = self.throttles
+        for obj in self._iterate_objects():
+            yield ListedObject.from_driver_object(obj, **kwargs)
 
     def __len__(self):
         """
@@ -201,6 +1327,8 @@ class Storage(object):
         Return the total objects in the container
         :return: int
         """
+        if self._is_local_driver():
+            return sum(1 for _ in scandir_files(self.container.get_cdn_url()))
         return len(self.container.list_objects())
 
     def __contains__(self, object_name):
@@ -210,11 +1338,9 @@ class Storage(object):
         :param object_name: the object name
         :return bool:
         """
-        try:
-            self.driver.get_object(self.container.name, object_name)
-            return True
-        except ObjectDoesNotExistError:
-            return False
+        if self._is_local_driver():
+            return os.path.isfile(self._local_path(object_name))
+        return self._get_driver_object(object_name) is not None
 
     def init_app(self, app):
         """
@@ -227,11 +1353,32 @@ class Storage(object):
         secret = app.config.get("STORAGE_SECRET", None)
         container = app.config.get("STORAGE_CONTAINER", None)
         allowed_extensions = app.config.get("STORAGE_ALLOWED_EXTENSIONS", None)
+        allowed_mimetypes = app.config.get("STORAGE_ALLOWED_MIMETYPES", None)
+        local_shards = app.config.get("STORAGE_LOCAL_SHARDS", None)
+        index_path = app.config.get("STORAGE_INDEX_PATH", None)
+        max_size = app.config.get("STORAGE_MAX_SIZE", None)
         serve_files = app.config.get("STORAGE_SERVER", True)
         serve_files_url = app.config.get("STORAGE_SERVER_URL", "files")
+        serve_archives_url = app.config.get("STORAGE_SERVER_ARCHIVE_URL", "archives")
+        cache_dir = app.config.get("STORAGE_CACHE_DIR", None)
+        cache_max_size = app.config.get("STORAGE_CACHE_MAX_SIZE", 1024 * 1024 * 1024)
+        serve_cache = app.config.get("STORAGE_SERVER_CACHE", False)
+        warmup = app.config.get("STORAGE_WARMUP", False)
+        throttle_rate = app.config.get("STORAGE_THROTTLE_RATE", None)
+        throttle_concurrency = app.config.get("STORAGE_THROTTLE_CONCURRENCY", None)
+        key_throttle_rate = app.config.get("STORAGE_KEY_THROTTLE_RATE", None)
+        key_throttle_concurrency = app.config.get("STORAGE_KEY_THROTTLE_CONCURRENCY", None)
+        upload_dir = app.config.get("STORAGE_UPLOAD_DIR", None)
+        upload_server_url = app.config.get("STORAGE_UPLOAD_SERVER_URL", "uploads")
+        upload_expires = app.config.get("STORAGE_UPLOAD_EXPIRES", 86400)
+        events_journal = app.config.get("STORAGE_EVENTS_JOURNAL", None)
+        events_webhook_url = app.config.get("STORAGE_EVENTS_WEBHOOK_URL", None)
 
         self.config["serve_files"] = serve_files
         self.config["serve_files_url"] = serve_files_url
+        self.config["serve_archives_url"] = serve_archives_url
+        self.config["serve_cache"] = serve_cache
+        self.config["upload_server_url"] = upload_server_url
 
         if not provider:
             raise ValueError("'STORAGE_PROVIDER' is missing")
@@ -241,176 +1388,1174 @@ class Storage(object):
                 raise IOError("Local Container (directory) '%s' is not a "
                               "directory or doesn't exist for LOCAL provider" % container)
 
+        cache = None
+        if cache_dir and provider.upper() != "LOCAL":
+            cache = LocalCache(cache_dir, max_size=cache_max_size)
+
+        throttle = None
+        if throttle_rate or throttle_concurrency:
+            throttle = Throttle(rate=throttle_rate, concurrency=throttle_concurrency)
+        throttle_group = None
+        if key_throttle_rate or key_throttle_concurrency:
+            throttle_group = ThrottleGroup(rate=key_throttle_rate, concurrency=key_throttle_concurrency)
+
+        # Keep the sinks subscribed before
+        events = list(self.events)
+        if events_journal:
+            events.append(JournalSink(events_journal))
+        if events_webhook_url:
+            events.append(WebhookSink(events_webhook_url))
+
         self.__init__(provider=provider,
                       key=key,
                       secret=secret,
                       container=container,
-                      allowed_extensions=allowed_extensions)
+                      allowed_extensions=allowed_extensions,
+                      cache=cache,
+                      max_size=max_size,
+                      allowed_mimetypes=allowed_mimetypes,
+                      local_shards=local_shards,
+                      index=ObjectIndex(index_path) if index_path else None,
+                      warmup=warmup,
+                      throttle=throttle,
+                      throttle_group=throttle_group,
+                      events=events)
+
+        if upload_dir:
+            self.uploads = ResumableUploads(self, upload_dir, expires=upload_expires)
 
         self._register_file_server(app)
+        self._register_upload_server(app)
 
     @contextmanager
-    def use(self, container):
+    def use(self, container, throttle=None):
         """
         A context manager to temporarily use a different container on the same driver
         :param container: str - the name of the container (bucket or a dir name if local)
+        :param throttle: Throttle - limits of this container, on top of the storage ones
         :yield: Storage
         """
-        kw = self._kw.copy()
-        kw["container"] = container
-        s = Storage(**kw)
-        yield s
-        del s
+        kw = self._kw.copy()
+        kw["container"] = container
+        # The sinks subscribed since, and the uploads set up by `init_app`
+        kw["events"] = self.events
+        s = Storage(**kw)
+        s.uploads = self.uploads
+        if throttle is not None:
+            s.throttles += (throttle,)
+        yield s
+        del s
+
+    def subscribe(self, sink):
+        """
+        Add a sink of the change events
+        :param sink: callable - receives each event, a dict with:
+                id, type (created, overwritten, deleted, copied), container, name,
+                size, hash, source (the copied object name) and time
+        """
+        if not isinstance(self.events, list):
+            self.events = list(self.events)
+        self.events.append(sink)
+
+    @contextmanager
+    def throttled(self, key):
+        """
+        A context manager to use the storage with the limits of a key, ie: a tenant,
+        on top of the storage ones
+        :param key: str
+        :yield: Storage
+        """
+        if self.throttle_group is None:
+            raise ValueError("'throttle_group' is not set")
+        s = copy.copy(self)
+        s.throttles = self.throttles + (self.throttle_group.get(key),)
+        yield s
+        del s
+
+    def get(self, object_name):
+        """
+        Return an object or None if it doesn't exist
+        :param object_name:
+        :return: Object
+        """
+        if self._is_local_driver():
+            try:
+                stat = os.stat(self._local_path(object_name))
+            except OSError:
+                return None
+            if not stat_lib.S_ISREG(stat.st_mode):
+                return None
+            return Object(obj=_make_local_object(self.driver, self.container, object_name, stat),
+                          throttles=self.throttles, storage=self)
+        obj = self._get_driver_object(object_name)
+        return Object(obj=obj, throttles=self.throttles, storage=self) if obj is not None else None
+
+    def _get_driver_object(self, object_name):
+        """
+        Return the driver object or None if it doesn't exist.
+        Concurrent lookups of the same object share a single provider call
+        :param object_name:
+        :return: libcloud.storage.base.Object
+        """
+        def _get():
+            from libcloud.storage.types import ObjectDoesNotExistError
+
+            try:
+                return self.driver.get_object(self.container.name, object_name)
+            except ObjectDoesNotExistError:
+                return None
+        return _flights.do(("get", self.driver.name, self.driver.key, self.container.name, object_name),
+                           _get)
+
+    def create(self, object_name, size=0, hash=None, extra=None, meta_data=None):
+        """
+        create a new object
+        :param object_name:
+        :param size:
+        :param hash:
+        :param extra:
+        :param meta_data:
+        :return: Object
+        """
+        from libcloud.storage.base import Object as BaseObject
+
+        obj = BaseObject(container=self.container,
+                         driver=self.driver,
+                         name=object_name,
+                         size=size,
+                         hash=hash,
+                         extra=extra,
+                         meta_data=meta_data)
+        return Object(obj=obj, throttles=self.throttles, storage=self)
+
+    def upload(self,
+               file,
+               name=None,
+               prefix=None,
+               extensions=None,
+               overwrite=False,
+               public=False,
+               random_name=False,
+               max_size=None,
+               mimetypes=None,
+               **kwargs):
+        """
+        To upload file
+        :param file: FileStorage object or string location
+        :param name: The name of the object.
+        :param prefix: A prefix for the object. Can be in the form of directory tree
+        :param extensions: list of extensions to allow. If empty, it will use all extension.
+        :param overwrite: bool - To overwrite if file exists
+        :param public: bool - To set acl to private or public-read. Having acl in kwargs will override it
+        :param random_name - If True and Name is None it will create a random name.
+                Otherwise it will use the file name. `name` will always take precedence
+        :param max_size: int - max size in bytes of the file. If empty, it will use `self.max_size`
+        :param mimetypes: list of mimetypes to allow, ie: image/png or image/*.
+                If empty, it will use `self.allowed_mimetypes`
+        :param kwargs: extra params: ie: acl, meta_data etc.
+        :return: Object
+        """
+        params = dict(name=name,
+                      prefix=prefix,
+                      extensions=extensions,
+                      overwrite=overwrite,
+                      public=public,
+                      random_name=random_name,
+                      max_size=max_size,
+                      mimetypes=mimetypes)
+        params.update(kwargs)
+
+        # Concurrent uploads of the same url with the same params share a single ingestion
+        if isinstance(file, str) and re.match(URL_REGEXP, file) and not random_name:
+            key = ("upload", self.driver.name, self.driver.key, self.container.name, file,
+                   repr(sorted(params.items())))
+            return _flights.do(key, self._upload, file, **params)
+        return self._upload(file, **params)
+
+    def _upload(self, file, **kwargs):
+        with self._prepare_upload(file, **kwargs) as (file, name, extra, max_size):
+            if isinstance(file, FileStorage):
+                obj = self._put_object(name,
+                                       iterator=_SizeLimitedStream(file.stream, max_size),
+                                       extra=extra)
+            else:
+                obj = self._put_object(name, file_path=file, extra=extra)
+            return Object(obj=obj, throttles=self.throttles, storage=self)
+
+    @contextmanager
+    def _prepare_upload(self,
+                        file,
+                        name=None,
+                        prefix=None,
+                        extensions=None,
+                        overwrite=False,
+                        public=False,
+                        random_name=False,
+                        max_size=None,
+                        mimetypes=None,
+                        storages=None,
+                        **kwargs):
+        """
+        Validate a file and prepare its upload: the extra params, the object name,
+        and the download of a url to a temp file, which is removed on exit
+        :params: same as `upload`
+        :param storages: list - the storages to upload to, this one by default
+        :yield: tuple - (the file or the temp file, the object name, extra, max size)
+        """
+        tmp_file = None
+        try:
+            if "acl" not in kwargs:
+                kwargs["acl"] = "public-read" if public else "private"
+            max_size = max_size or self.max_size
+
+            # Reject the file before any bytes move
+            self._validate_upload(file,
+                                  extensions=extensions,
+                                  max_size=max_size,
+                                  mimetypes=mimetypes,
+                                  **kwargs)
+
+            # It seems like this is a url, we'll try to download it first
+            if isinstance(file, str) and re.match(URL_REGEXP, file):
+                tmp_file = self._download_from_url(file, max_size=max_size)
+                file = tmp_file
+
+            name = self._prepare_object_name(file,
+                                             name=name,
+                                             prefix=prefix,
+                                             overwrite=overwrite,
+                                             random_name=random_name,
+                                             storages=storages)
+            yield file, name, kwargs, max_size
+        finally:
+            if tmp_file and os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+
+    def sync(self,
+             local_dir,
+             prefix="",
+             delete=False,
+             dry_run=False,
+             extensions=None,
+             public=False,
+             manifest=None,
+             workers=4):
+        """
+        Mirror a local directory into the container, uploading only what changed
+        :param local_dir: str - the local directory to mirror
+        :param prefix: str - the prefix of the objects in the container. Add a trailing slash
+                to make it a directory
+        :param delete: bool - To delete the objects that are not in the local directory anymore.
+                Only the objects with an extension to sync are deleted
+        :param dry_run: bool - To only compute the changes, without applying them
+        :param extensions: list - extensions to sync. If empty, the allowed extensions of the storage
+        :param public: bool - To set acl to private or public-read
+        :param manifest: str - path of a json file to persist the local hashes, so
+                unchanged files are not hashed again on the next sync. It's required to skip
+                the unchanged files on providers whose hash is not the md5 of the content,
+                ie: S3 multipart uploads. LOCAL objects are compared with their content otherwise
+        :param workers: int - number of parallel uploads
+        :return: dict - lists of "uploaded", "deleted", "unchanged" object names,
+                the "skipped" local files whose extension is not synced, and the "errors" by object name
+        """
+        if not os.path.isdir(local_dir):
+            raise IOError("'%s' is not a valid directory" % local_dir)
+
+        prefix = (prefix or "").lstrip("/")
+        entries = {}
+        if manifest and os.path.isfile(manifest):
+            with open(manifest) as f:
+                entries = json.load(f)
+
+        allowed_extensions = extensions or self.allowed_extensions
+        is_local = self._is_local_driver()
+
+        remote = {}
+        for obj in self._iterate_objects(prefix):
+            remote[obj.name] = (obj.size, obj.hash)
+
+        uploads = []
+        unchanged = []
+        skipped = []
+        local_names = set()
+        for folder, _, files in os.walk(local_dir):
+            for filename in files:
+                path = os.path.join(folder, filename)
+                rel_path = os.path.relpath(path, local_dir).replace(os.sep, "/")
+                object_name = prefix + rel_path
+                if get_file_extension(filename) not in allowed_extensions:
+                    skipped.append(object_name)
+                    continue
+                local_names.add(object_name)
+
+                stat = os.stat(path)
+                entry = entries.get(object_name)
+                if not entry or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+                    entry = {"size": stat.st_size,
+                             "mtime": stat.st_mtime,
+                             "md5": get_file_md5(path),
+                             "hash": None}
+                    entries[object_name] = entry
+
+                # The remote hash is either the md5 (ie: S3 ETag), or the hash
+                # recorded when this file was last uploaded. The LOCAL hash is
+                # the mtime, the content of the object is hashed instead
+                size, hash = remote.get(object_name, (None, None))
+                if size == stat.st_size \
+                        and (hash in (entry["md5"], entry["hash"])
+                             or (is_local and get_file_md5(self._local_path(object_name)) == entry["md5"])):
+                    unchanged.append(object_name)
+                else:
+                    uploads.append((object_name, path))
+
+        deletes = []
+        if delete:
+            deletes = sorted(name for name in set(remote) - local_names
+                             if get_file_extension(name) in allowed_extensions)
+
+        result = {
+            "uploaded": [name for name, _ in uploads],
+            "deleted": deletes,
+            "unchanged": unchanged,
+            "skipped": sorted(skipped),
+            "errors": {}
+        }
+        if dry_run:
+            return result
+
+        extra = {"acl": "public-read" if public else "private"}
+
+        def _upload(item):
+            object_name, path = item
+            return self._put_object(object_name, file_path=path, extra=extra)
+
+        uploaded = []
+        for (object_name, _), obj, error in run_parallel(_upload, uploads, workers):
+            if error:
+                result["errors"][object_name] = error
+                entries.pop(object_name, None)
+            else:
+                entries[object_name]["hash"] = obj.hash
+                uploaded.append(object_name)
+        result["uploaded"] = sorted(uploaded)
+
+        deleted = self.delete_many(deletes, workers=workers)
+        for object_name in deletes:
+            if object_name in deleted:
+                entries.pop(object_name, None)
+            else:
+                result["errors"][object_name] = IOError("Unable to delete '%s'" % object_name)
+        result["deleted"] = sorted(deleted)
+
+        if manifest:
+            tmp_manifest = "%s.%s" % (manifest, uuid.uuid4().hex)
+            with open(tmp_manifest, "w") as f:
+                json.dump(entries, f)
+            os.rename(tmp_manifest, manifest)
+
+        return result
+
+    def verify(self, prefix=None, workers=4, checkpoint=None, throttle=None, checkpoint_interval=30):
+        """
+        Check that the content of the objects matches their listing, hashing them in parallel.
+        LOCAL files are mapped in memory, remote objects are streamed by ranges.
+        The mismatches are:
+            - size: the content size isn't the listed size
+            - hash: the md5 of the content isn't the listed hash (S3 ETag)
+            - content: the content changed since the last full scan, but not the listing
+              (size and hash), ie: a corrupted file on LOCAL
+        :param prefix: str - verify the objects starting with prefix
+        :param workers: int - number of objects hashed in parallel
+        :param checkpoint: str - path of a json file to save the progress to, so an interrupted
+                scan resumes where it stopped. It keeps the content hashes of the last full scan
+                to find the `content` mismatches. Use one per prefix
+        :param throttle: Throttle - to limit the scan, on top of the storage limits
+        :param checkpoint_interval: int - seconds between the saves of the checkpoint
+        :return: dict - lists of "verified" and "skipped" (done before resuming) object names,
+                the "mismatches" and the "errors" by object name
+        """
+        state = {"baseline": {}, "verified": {}}
+        if checkpoint and os.path.isfile(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+        baseline = state["baseline"]
+        verified = state["verified"]
+
+        throttles = self.throttles + ((throttle,) if throttle is not None else ())
+        is_local = self._is_local_driver()
+        # On S3 the hash is the md5 of the content, except for multipart uploads
+        has_md5 = self._is_s3_driver()
+        lock = threading.Lock()
+        result = {"verified": [], "skipped": [], "mismatches": {}, "errors": {}}
+        saved = [time.time()]
+
+        def _save():
+            tmp_checkpoint = "%s.%s" % (checkpoint, uuid.uuid4().hex)
+            with open(tmp_checkpoint, "w") as f:
+                json.dump(state, f)
+            os.rename(tmp_checkpoint, checkpoint)
+
+        def _objects():
+            for obj in self._iterate_objects(prefix):
+                entry = verified.get(obj.name)
+                if entry and entry["size"] == obj.size and entry["hash"] == obj.hash:
+                    result["skipped"].append(obj.name)
+                    if entry.get("mismatch"):
+                        result["mismatches"][obj.name] = entry["mismatch"]
+                else:
+                    yield obj
+
+        def _verify(obj):
+            with throttle_slots(throttles):
+                if is_local:
+                    md5, size = get_file_md5_mmap(self.driver.get_object_cdn_url(obj), throttles)
+                else:
+                    md5, size = get_object_md5(self.driver, obj, throttles)
+
+            mismatch = None
+            previous = baseline.get(obj.name)
+            if size != obj.size:
+                mismatch = "size"
+            elif has_md5 and MD5_REGEXP.match(obj.hash or "") and md5 != obj.hash:
+                mismatch = "hash"
+            elif previous and previous["size"] == obj.size and previous["hash"] == obj.hash \
+                    and previous["md5"] != md5:
+                mismatch = "content"
+
+            with lock:
+                verified[obj.name] = {"size": obj.size, "hash": obj.hash, "md5": md5, "mismatch": mismatch}
+                if checkpoint and time.time() - saved[0] > checkpoint_interval:
+                    _save()
+                    saved[0] = time.time()
+            return mismatch
+
+        try:
+            for obj, mismatch, error in run_parallel(_verify, _objects(), workers):
+                if error:
+                    result["errors"][obj.name] = error
+                else:
+                    result["verified"].append(obj.name)
+                    if mismatch:
+                        result["mismatches"][obj.name] = mismatch
+        except BaseException:
+            if checkpoint:
+                _save()
+            raise
+
+        if checkpoint:
+            # A full scan is done: its hashes are the new baseline, except for the
+            # mismatches, which keep the last good ones until they are repaired
+            new_baseline = {}
+            for name, entry in verified.items():
+                if entry["mismatch"]:
+                    if name in baseline:
+                        new_baseline[name] = baseline[name]
+                else:
+                    new_baseline[name] = dict(entry)
+                    del new_baseline[name]["mismatch"]
+            state = {"baseline": new_baseline, "verified": {}}
+            _save()
+
+        result["verified"].sort()
+        return result
+
+    def copy(self, object_name, new_name, overwrite=False):
+        """
+        Copy an object to a new name in the container.
+        It's a provider side copy when supported, a hard link on LOCAL,
+        otherwise the object is streamed from the provider back to it.
+        :param object_name: str - the name of the object to copy
+        :param new_name: str - the name of the copy
+        :param overwrite: bool - To overwrite if the new object exists,
+                otherwise a uuid is added to the new name
+        :return: Object - the new object
+        """
+        from libcloud.storage.types import ObjectDoesNotExistError
+
+        new_name = new_name.lstrip("/")
+        if new_name == object_name:
+            raise ValueError("Can't copy '%s' onto itself" % object_name)
+        if not overwrite:
+            new_name = self._safe_object_name(new_name)
+
+        if self._is_local_driver():
+            src = self._local_path(object_name)
+            if not os.path.isfile(src):
+                raise ObjectDoesNotExistError(value=None, driver=self.driver, object_name=object_name)
+            dst = self._local_path(new_name)
+            self._make_local_dirs(dst)
+            if os.path.exists(dst):
+                os.remove(dst)
+            try:
+                os.link(src, dst)
+            except OSError:
+                # ie: file system without hard links
+                shutil.copy2(src, dst)
+            obj = self.container.get_object(new_name)
+        elif self._is_s3_driver():
+            obj = self._s3_copy(object_name, new_name)
+        else:
+            src = self.container.get_object(object_name)
+            extra = {"meta_data": src.meta_data or {}}
+            if src.extra.get("content_type"):
+                extra["content_type"] = src.extra["content_type"]
+            obj = self._put_object(new_name,
+                                   iterator=self.driver.download_object_as_stream(src, CHUNK_SIZE),
+                                   extra=extra,
+                                   emit=False)
+        self._index_add([obj])
+        self._emit("copied", obj.name, obj, source=object_name)
+        return Object(obj=obj, throttles=self.throttles, storage=self)
+
+    def move(self, object_name, new_name, overwrite=False):
+        """
+        Move (rename) an object in the container.
+        It's a rename on LOCAL, otherwise a copy and delete
+        :param object_name: str - the name of the object to move
+        :param new_name: str - the new name
+        :param overwrite: bool - To overwrite if the new object exists,
+                otherwise a uuid is added to the new name
+        :return: Object - the moved object
+        """
+        from libcloud.storage.types import ObjectDoesNotExistError
+
+        if self._is_local_driver():
+            new_name = new_name.lstrip("/")
+            if new_name == object_name:
+                raise ValueError("Can't move '%s' onto itself" % object_name)
+            if not overwrite:
+                new_name = self._safe_object_name(new_name)
+            src = self._local_path(object_name)
+            if not os.path.isfile(src):
+                raise ObjectDoesNotExistError(value=None, driver=self.driver, object_name=object_name)
+            dst = self._local_path(new_name)
+            self._make_local_dirs(dst)
+            os.rename(src, dst)
+            self._remove_empty_local_dirs(src)
+            obj = self.container.get_object(new_name)
+            self._index_remove([object_name])
+            self._index_add([obj])
+            self._emit("copied", obj.name, obj, source=object_name)
+            self._emit("deleted", object_name)
+            return Object(obj=obj, throttles=self.throttles, storage=self)
+
+        obj = self.copy(object_name, new_name, overwrite=overwrite)
+        if object_name not in self.delete_many([object_name]):
+            raise IOError("Unable to delete '%s' after copying it to '%s'" % (object_name, obj.name))
+        return obj
+
+    def copy_prefix(self, prefix, new_prefix, overwrite=False, workers=8):
+        """
+        Copy all the objects under a prefix to a new prefix, in parallel
+        :param prefix: str
+        :param new_prefix: str
+        :param overwrite: bool
+        :param workers: int - number of parallel copies
+        :return: list - the new objects
+        """
+        return self._transfer_prefix(self.copy, prefix, new_prefix, overwrite, workers)
+
+    def move_prefix(self, prefix, new_prefix, overwrite=False, workers=8):
+        """
+        Move all the objects under a prefix to a new prefix, in parallel
+        :param prefix: str
+        :param new_prefix: str
+        :param overwrite: bool
+        :param workers: int - number of parallel moves
+        :return: list - the moved objects
+        """
+        return self._transfer_prefix(self.move, prefix, new_prefix, overwrite, workers)
+
+    def delete_many(self, object_names, workers=8):
+        """
+        Delete many objects at once.
+        It uses the provider batch delete when supported, otherwise parallel deletes
+        :param object_names: list
+        :param workers: int - number of parallel deletes
+        :return: list - the names of the deleted objects
+        """
+        deleted = self._delete_many(list(object_names), workers)
+        self._index_remove(deleted)
+        for object_name in deleted:
+            self._emit("deleted", object_name)
+        return deleted
+
+    def _delete_many(self, object_names, workers):
+        if self._is_local_driver():
+            deleted = []
+            for object_name in object_names:
+                path = self._local_path(object_name)
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._remove_empty_local_dirs(path)
+                deleted.append(object_name)
+            return deleted
+
+        if self._is_s3_driver() and self.driver.http_vendor_prefix == "x-amz":
+            batches = [object_names[i:i + 1000] for i in range(0, len(object_names), 1000)]
+            deleted = []
+            for _, names, error in run_parallel(self._s3_delete_batch, batches, workers):
+                if not error:
+                    deleted.extend(names)
+            return deleted
+
+        def _delete(object_name):
+            obj = self.create(object_name)
+            return self.driver.delete_object(obj._obj)
+
+        return [object_name
+                for object_name, result, error in run_parallel(_delete, object_names, workers)
+                if result and not error]
+
+    def delete_prefix(self, prefix, workers=8):
+        """
+        Delete all the objects under a prefix
+        :param prefix: str
+        :param workers: int - number of parallel deletes
+        :return: list - the names of the deleted objects
+        """
+        if not prefix:
+            raise ValueError("'prefix' is missing")
+        return self.delete_many([obj.name for obj in self._iterate_objects(prefix)],
+                                workers=workers)
+
+    def stream_archive(self, prefix=None, names=None, format="zip", workers=4):
+        """
+        Stream an archive of objects, built on the fly. The first bytes come right away,
+        and the memory use doesn't depend on the objects sizes.
+        The next `workers` objects are downloaded ahead, concurrently
+        :param prefix: str - archive the objects starting with prefix
+        :param names: list - or archive these objects. The missing ones are skipped
+        :param format: str - zip, tar or tar.gz
+        :param workers: int - number of objects downloaded ahead
+        :return: generator of bytes
+        """
+        if format not in ARCHIVE_FORMATS:
+            raise ValueError("Invalid archive format '%s'. Must be one of: %s"
+                             % (format, ", ".join(ARCHIVE_FORMATS)))
+
+        def _objects():
+            if names is None:
+                for obj in self._iterate_objects(prefix):
+                    yield obj
+            else:
+                for name in names:
+                    obj = self.get(name)
+                    if obj is not None:
+                        yield obj._obj
+
+        def _open_stream(obj):
+            with throttle_slots(self.throttles):
+                stream = self.driver.download_object_as_stream(obj, CHUNK_SIZE)
+                for chunk in throttle_iterator(stream, self.throttles):
+                    yield chunk
+
+        output = _ChunkQueue()
+        prefetcher = _Prefetcher(_objects(), _open_stream, workers=workers)
+
+        def _write():
+            try:
+                _write_archive(output, prefetcher, format)
+                output.finish()
+            except Exception as e:
+                output.finish(e)
+            finally:
+                prefetcher.close()
+
+        def _stream():
+            thread = threading.Thread(target=_write)
+            thread.daemon = True
+            thread.start()
+            try:
+                for chunk in output:
+                    yield chunk
+            finally:
+                # ie: the client went away
+                output.close()
+
+        return _stream()
+
+    def query(self,
+              prefix=None,
+              type=None,
+              extension=None,
+              min_size=None,
+              max_size=None,
+              order_by="name",
+              desc=False,
+              limit=None):
+        """
+        Return the objects matching all the filters, from the index
+        :param prefix: str - the objects names start with it
+        :param type: str - the group of the extension, ie: IMAGE, AUDIO
+        :param extension: str
+        :param min_size: int - in bytes
+        :param max_size: int - in bytes
+        :param order_by: str - name, size or mtime
+        :param desc: bool - To sort in descending order
+        :param limit: int
+        :return: list of ListedObject
+        """
+        if self.index is None:
+            raise ValueError("'index' is missing. Set 'STORAGE_INDEX_PATH'")
+        rows = self.index.query(self._index_key(),
+                                prefix=prefix,
+                                type=type,
+                                extension=extension,
+                                min_size=min_size,
+                                max_size=max_size,
+                                order_by=order_by,
+                                desc=desc,
+                                limit=limit)
+        return [ListedObject(name=row["name"],
+                             size=row["size"],
+                             hash=row["hash"],
+                             mtime=row["mtime"],
+                             container=self.container,
+                             driver=self.driver,
+                             storage=self)
+                for row in rows]
+
+    def reindex(self):
+        """
+        Rebuild the index of the container from a full listing
+        :return: int - the number of objects indexed
+        """
+        if self.index is None:
+            raise ValueError("'index' is missing. Set 'STORAGE_INDEX_PATH'")
+        return self.index.rebuild(self._index_key(), self._iterate_objects())
+
+    def _index_key(self):
+        """
+        The container in the index. LOCAL containers have no name, the path is used
+        :return: str
+        """
+        if self._is_local_driver():
+            return os.path.abspath(self.container.get_cdn_url())
+        return self.container.name
+
+    def _index_add(self, objects):
+        if self.index is not None:
+            self.index.add(self._index_key(), objects)
+
+    def _index_remove(self, object_names):
+        if self.index is not None and object_names:
+            self.index.remove(self._index_key(), object_names)
+
+    def _emit(self, type, object_name, obj=None, source=None):
+        """
+        Send a change event to the sinks. A sink that fails doesn't fail the change
+        """
+        if not self.events:
+            return
+        event = {
+            "id": uuid.uuid4().hex,
+            "type": type,
+            "container": self._index_key(),
+            "name": object_name,
+            "size": obj.size if obj is not None else None,
+            "hash": obj.hash if obj is not None else None,
+            "source": source,
+            "time": time.time()
+        }
+        for sink in self.events:
+            try:
+                sink(event)
+            except Exception as e:
+                warnings.warn("Flask-Cloudy event sink failed: %s" % e)
+
+    def _transfer_prefix(self, func, prefix, new_prefix, overwrite, workers):
+        if not prefix:
+            raise ValueError("'prefix' is missing")
+        names = [obj.name for obj in self._iterate_objects(prefix)]
+
+        def _transfer(object_name):
+            return func(object_name, new_prefix + object_name[len(prefix):], overwrite=overwrite)
+
+        results = run_parallel(_transfer, names, workers)
+        for _, _, error in results:
+            if error:
+                raise error
+        return [obj for _, obj, _ in results]
+
+    def _put_object(self, object_name, file_path=None, iterator=None, extra=None, emit=True):
+        """
+        Write an object in the container, from a file path or an iterator
+        :param object_name: str
+        :param file_path: str
+        :param iterator: iterator of bytes
+        :param extra: dict
+        :param emit: bool - to send the created or overwritten event
+        :return: the driver object
+        """
+        existed = emit and bool(self.events) and object_name in self
+
+        # The sharded driver writes to a temp file and renames it already
+        is_local = self._is_local_driver() \
+            and not isinstance(self.driver, get_sharded_driver_class())
+        if self.throttles:
+            if iterator is None:
+                iterator = iterate_file(file_path)
+            iterator = throttle_iterator(iterator, self.throttles)
+        with throttle_slots(self.throttles):
+            if is_local:
+                obj = self._write_local_object(object_name, file_path=file_path, iterator=iterator)
+            elif iterator is not None:
+                obj = self.container.upload_object_via_stream(iterator=iterator,
+                                                              object_name=object_name,
+                                                              extra=extra)
+            else:
+                obj = self.container.upload_object(file_path=file_path,
+                                                   object_name=object_name,
+                                                   extra=extra)
+        self._index_add([obj])
+        if emit:
+            self._emit("overwritten" if existed else "created", obj.name, obj)
+        return obj
+
+    def _write_local_object(self, object_name, file_path=None, iterator=None):
+        """
+        Write an object of the flat LOCAL layout to a temp file, then rename it.
+        The existing object is only replaced once the new content is complete, and
+        the rename breaks the hard links made by `copy`, so the copies don't change with it
+        :param object_name: str
+        :param file_path: str
+        :param iterator: iterator of bytes
+        :return: the driver object
+        """
+        path = self._local_path(object_name)
+        self._make_local_dirs(path)
+        tmp_path = "%s.%s%s" % (path, uuid.uuid4().hex, TMP_SUFFIX)
+        try:
+            if iterator is not None:
+                with open(tmp_path, "wb") as f:
+                    for data in iterator:
+                        f.write(data)
+            else:
+                shutil.copyfile(file_path, tmp_path)
+            os.chmod(tmp_path, int("664", 8))
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+        return self.container.get_object(object_name)
+
+    def _local_path(self, object_name):
+        """
+        Return the path of the object on LOCAL
+        :param object_name: str
+        :return: str
+        """
+        if isinstance(self.driver, get_sharded_driver_class()):
+            return self.driver.get_object_path(self.container, object_name)
+        return os.path.join(self.container.get_cdn_url(), object_name)
+
+    def _make_local_dirs(self, path):
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def _remove_empty_local_dirs(self, path):
+        """
+        Remove the empty parent directories of the path, up to the container
+        """
+        container_path = os.path.normpath(self.container.get_cdn_url())
+        path = os.path.dirname(os.path.normpath(path))
+        while path != container_path and path.startswith(container_path):
+            try:
+                os.rmdir(path)
+            except OSError:
+                break
+            path = os.path.dirname(path)
+
+    def _is_local_driver(self):
+        """
+        The LOCAL driver, sharded or not
+        :return: bool
+        """
+        from libcloud.storage.drivers import local
+
+        return isinstance(self.driver, local.LocalStorageDriver)
+
+    def _is_s3_driver(self):
+        """
+        S3 and the S3 compatible drivers (ie: Google Storage)
+        :return: bool
+        """
+        return hasattr(self.driver, "http_vendor_prefix") \
+            and hasattr(self.driver, "_get_object_path")
+
+    def _s3_copy(self, object_name, new_name):
+        """
+        Provider side copy for S3 compatible drivers. The acl of the object is kept
+        """
+        from libcloud.storage.types import ObjectDoesNotExistError
+
+        prefix = self.driver.http_vendor_prefix
+        headers = {
+            "%s-copy-source" % prefix: self.driver._get_object_path(self.container, object_name),
+            "%s-acl" % prefix: self._s3_object_acl(object_name)
+        }
+        response = self.driver.connection.request(
+            self.driver._get_object_path(self.container, new_name),
+            method="PUT",
+            headers=headers)
+        if response.status == 404:
+            raise ObjectDoesNotExistError(value=None, driver=self.driver, object_name=object_name)
+        # The copy can fail after the 200 status is sent, with an error in the body
+        if response.status != 200 or "<Error>" in (response.body or ""):
+            raise IOError("Unable to copy '%s' to '%s'" % (object_name, new_name))
+        return self.container.get_object(new_name)
+
+    def _s3_object_acl(self, object_name):
+        """
+        Return the canned acl of an object for S3 compatible drivers
+        :return: str - public-read when all the users can read it, otherwise private
+        """
+        from libcloud.storage.types import ObjectDoesNotExistError
+
+        response = self.driver.connection.request(
+            self.driver._get_object_path(self.container, object_name),
+            params={"acl": ""})
+        if response.status == 404:
+            raise ObjectDoesNotExistError(value=None, driver=self.driver, object_name=object_name)
+        if response.status != 200:
+            raise IOError("Unable to get the acl of '%s'" % object_name)
+        # A grant to the AllUsers group on S3, an entry with the AllUsers scope on Google Storage
+        for _, grant in re.findall(r"<(Grant|Entry)>(.*?)</\1>", response.body or "", re.S):
+            if "AllUsers" in grant \
+                    and re.search(r"<Permission>(READ|FULL_CONTROL)</Permission>", grant):
+                return "public-read"
+        return "private"
+
+    def _s3_delete_batch(self, object_names):
+        """
+        S3 multi objects delete, up to 1000 objects
+        :return: list - the names of the deleted objects
+        """
+        from xml.sax.saxutils import escape as xml_escape
+
+        body = "<?xml version=\"1.0\" encoding=\"UTF-8\"?><Delete><Quiet>true</Quiet>%s</Delete>" \
+               % "".join("<Object><Key>%s</Key></Object>" % xml_escape(name)
+                         for name in object_names)
+        body = body.encode("utf-8")
+        headers = {
+            "Content-MD5": base64.b64encode(hashlib.md5(body).digest()).decode("ascii"),
+            "Content-Type": "application/xml"
+        }
+        response = self.driver.connection.request(
+            self.driver._get_container_path(self.container),
+            method="POST",
+            params={"delete": ""},
+            data=body,
+            headers=headers)
+        if response.status != 200:
+            raise IOError("Unable to delete objects in '%s'" % self.container.name)
+        errors = re.findall(r"<Error>\s*<Key>(.*?)</Key>", response.body or "", re.S)
+        return [name for name in object_names if xml_escape(name) not in errors]
+
+    def _iterate_objects(self, prefix=None):
+        """
+        Iterate over the driver objects in the container, filtered by prefix
+        :param prefix: str
+        :return: generator
+        """
+        is_local = self._is_local_driver()
+        if is_local and not isinstance(self.driver, get_sharded_driver_class()):
+            # The listing of the LOCAL driver has the temp files of the uploads in progress
+            cpath = self.container.get_cdn_url()
+            objects = (_make_local_object(self.driver,
+                                          self.container,
+                                          os.path.relpath(entry.path, cpath).replace(os.sep, "/"),
+                                          entry.stat())
+                       for entry in scandir_files(cpath))
+        # The local driver filters the full listing anyway, with a warning
+        elif prefix and not is_local:
+            objects = self.container.iterate_objects(prefix=prefix)
+        else:
+            objects = self.container.iterate_objects()
+        for obj in objects:
+            if not prefix or obj.name.startswith(prefix):
+                yield obj
 
-    def get(self, object_name):
+    def _validate_upload(self, file, extensions=None, max_size=None, mimetypes=None, **kwargs):
         """
-        Return an object or None if it doesn't exist
-        :param object_name:
-        :return: Object
+        Validate the extension, size and mimetype of a file before it is transferred.
+        For a url, the size and mimetype come from a HEAD request, only when they are checked
+        :param file: FileStorage object, string location or url
+        :params: same as `upload`
         """
-        if object_name in self:
-            return Object(obj=self.container.get_object(object_name))
-        return None
-
-    def create(self, object_name, size=0, hash=None, extra=None, meta_data=None):
+        size = None
+        mimetype = None
+        if isinstance(file, FileStorage):
+            filename = file.filename
+            size = file.content_length or None
+            mimetype = file.mimetype or None
+        elif re.match(URL_REGEXP, file):
+            filename = urlparse(file).path
+            allowed_mimetypes = mimetypes or self.allowed_mimetypes
+            if max_size or allowed_mimetypes:
+                size, mimetype = self._head_url(file)
+        else:
+            filename = file
+            size = os.path.getsize(file)
+
+        extension = get_file_extension(filename)
+
+        # For backwards compatibility, kwargs now holds `allowed_extensions`
+        allowed_extensions = extensions or kwargs.get("allowed_extensions")
+        if not allowed_extensions:
+            allowed_extensions = self.allowed_extensions
+        if extension.lower() not in allowed_extensions:
+            raise InvalidExtensionError("Invalid file extension: '.%s' " % extension)
+
+        if max_size and size and size > max_size:
+            raise InvalidSizeError("File size of %s bytes exceeds the max size "
+                                   "of %s bytes" % (size, max_size))
+
+        allowed_mimetypes = mimetypes or self.allowed_mimetypes
+        if allowed_mimetypes:
+            mimetype = mimetype or guess_type(filename)[0]
+            if not mimetype or not any(mimetype == m or (m.endswith("/*") and mimetype.startswith(m[:-1]))
+                                       for m in allowed_mimetypes):
+                raise InvalidMimeTypeError("Invalid file mimetype: '%s'" % mimetype)
+
+    def _head_url(self, url):
         """
-        create a new object
-        :param object_name:
-        :param size:
-        :param hash:
-        :param extra:
-        :param meta_data:
-        :return: Object
+        Return the size and mimetype of a url, from a HEAD request
+        :param url:
+        :return: tuple - (int or None, str or None)
         """
-        obj = BaseObject(container=self.container,
-                         driver=self.driver,
-                         name=object_name,
-                         size=size,
-                         hash=hash,
-                         extra=extra,
-                         meta_data=meta_data)
-        return Object(obj=obj)
-
-    def upload(self,
-               file,
-               name=None,
-               prefix=None,
-               extensions=None,
-               overwrite=False,
-               public=False,
-               random_name=False,
-               **kwargs):
+        req = request.Request(url)
+        req.get_method = lambda: "HEAD"
+        try:
+            response = request.urlopen(req, timeout=10)
+        except Exception:
+            # Some servers don't support HEAD, the size is checked while downloading
+            return None, None
+        try:
+            length = response.info().get("Content-Length")
+            content_type = response.info().get("Content-Type")
+        finally:
+            response.close()
+        size = int(length) if length and length.isdigit() else None
+        mimetype = content_type.split(";")[0].strip() if content_type else None
+        return size, mimetype
+
+    def _prepare_object_name(self,
+                             file,
+                             name=None,
+                             prefix=None,
+                             overwrite=False,
+                             random_name=False,
+                             storages=None):
         """
-        To upload file
+        Return the object name to upload the file to
         :param file: FileStorage object or string location
-        :param name: The name of the object.
-        :param prefix: A prefix for the object. Can be in the form of directory tree
-        :param extensions: list of extensions to allow. If empty, it will use all extension.
-        :param overwrite: bool - To overwrite if file exists
-        :param public: bool - To set acl to private or public-read. Having acl in kwargs will override it
-        :param random_name - If True and Name is None it will create a random name.
-                Otherwise it will use the file name. `name` will always take precedence
-        :param kwargs: extra params: ie: acl, meta_data etc.
-        :return: Object
+        :params: same as `upload`
+        :param storages: list - the storages to upload to, this one by default
+        :return: str
         """
-        tmp_file = None
-        try:
-            if "acl" not in kwargs:
-                kwargs["acl"] = "public-read" if public else "private"
-            extra = kwargs
-
-            # It seems like this is a url, we'll try to download it first
-            if isinstance(file, string_types) and re.match(URL_REGEXP, file):
-                tmp_file = self._download_from_url(file)
-                file = tmp_file
-
-            # Create a random name
-            if not name and random_name:
-                name = uuid.uuid4().hex
-
-            # coming from a flask, or upload object
-            if isinstance(file, FileStorage):
-                extension = get_file_extension(file.filename)
-                if not name:
-                    fname = get_file_name(file.filename).split("." + extension)[0]
-                    name = slugify.slugify(fname)
-            else:
-                extension = get_file_extension(file)
-                if not name:
-                    name = get_file_name(file)
-
-            if len(get_file_extension(name).strip()) == 0:
-                name += "." + extension
+        storages = storages or [self]
+        import slugify
+
+        # Create a random name
+        if not name and random_name:
+            name = uuid.uuid4().hex
+
+        # coming from a flask, or upload object
+        if isinstance(file, FileStorage):
+            extension = get_file_extension(file.filename)
+            if not name:
+                fname = get_file_name(file.filename).split("." + extension)[0]
+                name = slugify.slugify(fname)
+        else:
+            extension = get_file_extension(file)
+            if not name:
+                name = get_file_name(file)
 
-            name = name.strip("/").strip()
+        if len(get_file_extension(name).strip()) == 0:
+            name += "." + extension
 
-            if isinstance(self.driver, local.LocalStorageDriver):
-                name = secure_filename(name)
+        name = name.strip("/").strip()
 
-            if prefix:
-                name = prefix.lstrip("/") + name
+        if any(storage._is_local_driver() for storage in storages):
+            name = secure_filename(name)
 
-            if not overwrite:
-                name = self._safe_object_name(name)
+        if prefix:
+            name = prefix.lstrip("/") + name
 
-            # For backwards compatibility, kwargs now holds `allowed_extensions`
-            allowed_extensions = extensions or kwargs.get("allowed_extensions")
-            if not allowed_extensions:
-                allowed_extensions = self.allowed_extensions
-            if extension.lower() not in allowed_extensions:
-                raise InvalidExtensionError("Invalid file extension: '.%s' " % extension)
+        if not overwrite:
+            name = self._safe_object_name(name, storages)
 
-            if isinstance(file, FileStorage):
-                obj = self.container.upload_object_via_stream(iterator=file.stream,
-                                                              object_name=name,
-                                                              extra=extra)
-            else:
-                obj = self.container.upload_object(file_path=file,
-                                                   object_name=name,
-                                                   extra=extra)
-            return Object(obj=obj)
-        except Exception as e:
-            raise e
-        finally:
-            if tmp_file and os.path.isfile(tmp_file):
-                os.remove(tmp_file)
+        return name
 
-    def _download_from_url(self, url):
+    def _download_from_url(self, url, max_size=None):
         """
         Download a url and return the tmp path
         :param url:
+        :param max_size: int - abort the download once it exceeds max_size bytes
         :return:
         """
-        ext = get_file_extension(url)
-        if "?" in url:
-            ext = get_file_extension(os.path.splitext(url.split("?")[0]))
+        ext = get_file_extension(urlparse(url).path)
         filepath = "/tmp/%s.%s" % (uuid.uuid4().hex, ext)
-        request.urlretrieve(url, filepath)
+        response = request.urlopen(url)
+        try:
+            with open(filepath, "wb") as f:
+                for chunk in _SizeLimitedStream(response, max_size):
+                    f.write(chunk)
+        except Exception:
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+            raise
+        finally:
+            response.close()
         return filepath
 
-    def _safe_object_name(self, object_name):
+    def _safe_object_name(self, object_name, storages=None):
         """ Add a UUID if to a object name if it exists. To prevent overwrites
         :param object_name:
+        :param storages: list - the storages it must not exist in, this one by default
         :return str:
         """
+        storages = storages or [self]
         extension = get_file_extension(object_name)
         file_name = os.path.splitext(object_name)[0]
-        while object_name in self:
+        while any(object_name in storage for storage in storages):
             nuid = uuid.uuid4().hex
             object_name = "%s__%s.%s" % (file_name, nuid, extension)
         return object_name
 
+    def get_local_path(self, obj):
+        """
+        Return a path on the local disk to read the object from.
+        LOCAL objects are read in place, remote objects go through the cache
+        :param obj: Object
+        :return: str or None if the object can't be read locally
+        """
+        if self._is_local_driver():
+            return obj.get_cdn_url()
+        if self.cache is not None:
+            return self.cache.get_path(obj)
+        return None
+
     def _register_file_server(self, app):
         """
         File server
-        Only local files can be served
+        Only local files, or remote files through the local cache when `STORAGE_SERVER_CACHE`
+        is set, can be served
         It's recommended to serve static files through NGINX instead of Python
         Use this for development only
         :param app: Flask app instance
 
         """
-        if isinstance(self.driver, local.LocalStorageDriver) \
-                and self.config["serve_files"]:
+        # From the provider name, to not create the driver at startup
+        is_local = "local" in self._kw.get("provider", "").lower()
+        # Remote objects are served without any access control, ie: private ones
+        serve_cache = self.cache is not None and self.config.get("serve_cache")
+        if (is_local or serve_cache) and self.config["serve_files"]:
             server_url = self.config["serve_files_url"].strip("/").strip()
             if server_url:
                 url = "/%s/<path:object_name>" % server_url
@@ -425,16 +2570,829 @@ class Storage(object):
                         if get_file_extension(name) != obj.extension:
                             name += ".%s" % obj.extension
 
-                        _url = obj.get_cdn_url()
+                        _url = self.get_local_path(obj)
+                        if _url is None:
+                            return redirect(obj.url)
                         return send_file(_url,
                                          as_attachment=True if dl else False,
-                                         attachment_filename=name,
+                                         download_name=name,
                                          conditional=True)
                     else:
                         abort(404)
             else:
                 warnings.warn("Flask-Cloudy can't serve files. 'STORAGE_SERVER_FILES_URL' is not set")
 
+            archive_url = (self.config.get("serve_archives_url") or "").strip("/").strip()
+            if archive_url:
+                url = "/%s/" % archive_url
+
+                @app.route(url, endpoint=ARCHIVE_SERVER_ENDPOINT, defaults={"prefix": ""})
+                @app.route(url + "<path:prefix>", endpoint=ARCHIVE_SERVER_ENDPOINT)
+                def archives_server(prefix):
+                    format = flask_request.args.get("format", "zip")
+                    if format not in ARCHIVE_FORMATS:
+                        abort(400)
+                    name = flask_request.args.get("name") \
+                        or prefix.strip("/").split("/")[-1] or "archive"
+                    if not name.endswith("." + format):
+                        name += ".%s" % format
+                    headers = {
+                        "Content-Disposition": "attachment; filename=%s" % secure_filename(name)
+                    }
+                    return Response(self.stream_archive(prefix=prefix, format=format),
+                                    mimetype=ARCHIVE_FORMATS[format],
+                                    headers=headers)
+
+    def _register_upload_server(self, app):
+        """
+        Resumable upload server, following the core of the tus protocol:
+            POST /uploads/ with the `Upload-Length` and `Upload-Metadata` (filename, filetype)
+                headers creates a session. Its url is in the `Location` header
+            HEAD /uploads/<upload_id> returns the `Upload-Offset` to resume from
+            PATCH /uploads/<upload_id> with the `Upload-Offset` header appends a chunk,
+                sent as `application/offset+octet-stream`
+            DELETE /uploads/<upload_id> cancels it
+        Once complete, the object name is in the `Upload-Object` header
+        :param app: Flask app instance
+        """
+        server_url = (self.config.get("upload_server_url") or "").strip("/").strip()
+        if self.uploads is None or not server_url:
+            return
+        uploads = self.uploads
+        url = "/%s/" % server_url
+
+        def _response(status, state=None):
+            response = Response(status=status)
+            response.headers["Tus-Resumable"] = TUS_VERSION
+            response.headers["Cache-Control"] = "no-store"
+            if state is not None:
+                response.headers["Upload-Offset"] = str(state["offset"])
+                response.headers["Upload-Length"] = str(state["length"])
+                if state["object"]:
+                    response.headers["Upload-Object"] = state["object"]
+            return response
+
+        @app.route(url, methods=["POST"], endpoint=UPLOAD_SERVER_ENDPOINT + "_CREATE")
+        def upload_create():
+            try:
+                length = int(flask_request.headers["Upload-Length"])
+                metadata = parse_upload_metadata(flask_request.headers.get("Upload-Metadata"))
+            except (KeyError, ValueError):
+                abort(400)
+            filename = metadata.get("filename") or metadata.get("name")
+            if not filename:
+                abort(400)
+            try:
+                upload_id = uploads.create(length, filename, metadata.get("filetype") or metadata.get("type"))
+            except InvalidSizeError:
+                abort(413)
+            except (InvalidExtensionError, InvalidMimeTypeError):
+                abort(415)
+            except ValueError:
+                abort(400)
+            response = _response(201, uploads.get(upload_id))
+            response.headers["Location"] = url_for(UPLOAD_SERVER_ENDPOINT, upload_id=upload_id, _external=True)
+            return response
+
+        @app.route(url + "<upload_id>", methods=["HEAD", "PATCH", "DELETE"], endpoint=UPLOAD_SERVER_ENDPOINT)
+        def upload_server(upload_id):
+            if flask_request.method == "DELETE":
+                if not uploads.delete(upload_id):
+                    abort(404)
+                return _response(204)
+
+            if flask_request.method == "PATCH":
+                if flask_request.mimetype != "application/offset+octet-stream":
+                    abort(415)
+                try:
+                    offset = int(flask_request.headers["Upload-Offset"])
+                except (KeyError, ValueError):
+                    abort(400)
+                try:
+                    state = uploads.write(upload_id, offset, flask_request.stream)
+                except InvalidSizeError:
+                    abort(413)
+                except ValueError:
+                    abort(409)
+                if state is None:
+                    abort(404)
+                return _response(204, state)
+
+            state = uploads.get(upload_id)
+            if state is None:
+                abort(404)
+            return _response(200, state)
+
+
+class ResumableUploads(object):
+    """
+    Resumable uploads, like the tus protocol: a session is created with the size
+    of the file, the client sends chunks at their offset, and after a failure it
+    resumes from the offset that was saved. Once the last chunk arrives, the file
+    is uploaded to the storage with `Storage.upload`, as a stream.
+    The sessions and their data are kept in a local directory.
+    """
+
+    ID_REGEXP = re.compile(r'^[0-9a-f]{32}$')
+
+    def __init__(self, storage, directory, expires=86400, **upload_kwargs):
+        """
+        :param storage: Storage
+        :param directory: str - where the sessions and their data are kept
+        :param expires: int - seconds after which a session is removed
+        :param upload_kwargs: params of `Storage.upload`, ie: prefix, public, random_name
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.storage = storage
+        self.directory = directory
+        self.expires = expires
+        self.upload_kwargs = upload_kwargs
+        self._locks = [threading.Lock() for _ in range(64)]
+        self._cleaned_at = time.time()
+
+    def create(self, length, filename, content_type=None):
+        """
+        Create an upload session. The file is validated like with `Storage.upload`
+        :param length: int - the size of the file
+        :param filename: str - the name of the file, for its extension and the object name
+        :param content_type: str
+        :return: str - the upload id
+        """
+        if length < 0:
+            raise ValueError("Invalid upload length: %s" % length)
+        self.storage._validate_upload(FileStorage(filename=filename,
+                                                  content_type=content_type,
+                                                  content_length=length),
+                                      extensions=self.upload_kwargs.get("extensions"),
+                                      max_size=self.upload_kwargs.get("max_size") or self.storage.max_size,
+                                      mimetypes=self.upload_kwargs.get("mimetypes"))
+
+        if time.time() - self._cleaned_at > min(self.expires, 3600):
+            self.cleanup()
+
+        upload_id = uuid.uuid4().hex
+        open(self._path(upload_id, "data"), "wb").close()
+        self._save(upload_id, {"length": length,
+                               "filename": filename,
+                               "content_type": content_type,
+                               "created_at": time.time(),
+                               "object": None})
+        if not length:
+            self._complete(upload_id, self._load(upload_id))
+        return upload_id
+
+    def get(self, upload_id):
+        """
+        Return the state of an upload session
+        :param upload_id: str
+        :return: dict - length, offset, filename, content_type, and the object name once
+                complete. None if it doesn't exist
+        """
+        state = self._load(upload_id)
+        if state is not None:
+            state["offset"] = state["length"] if state["object"] else \
+                os.path.getsize(self._path(upload_id, "data"))
+        return state
+
+    def write(self, upload_id, offset, stream):
+        """
+        Append a chunk at the offset, and upload the file once it's complete
+        :param upload_id: str
+        :param offset: int - must be the current offset of the session
+        :param stream: file object to read the chunk from
+        :return: dict - the state, see `get()`. None if it doesn't exist
+        """
+        with self._locks[hash(upload_id) % len(self._locks)]:
+            state = self.get(upload_id)
+            if state is None:
+                return None
+            if offset != state["offset"]:
+                raise ValueError("Invalid offset %s, the upload is at %s" % (offset, state["offset"]))
+
+            if not state["object"]:
+                # What was received is kept, even if the client goes away
+                with open(self._path(upload_id, "data"), "ab") as f:
+                    try:
+                        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                            if state["offset"] + len(chunk) > state["length"]:
+                                raise InvalidSizeError("The upload exceeds its length of %s bytes"
+                                                       % state["length"])
+                            f.write(chunk)
+                            state["offset"] += len(chunk)
+                    finally:
+                        f.flush()
+                        os.fsync(f.fileno())
+
+                if state["offset"] == state["length"]:
+                    self._complete(upload_id, state)
+            return self.get(upload_id)
+
+    def delete(self, upload_id):
+        """
+        Delete an upload session and its data
+        :param upload_id: str
+        :return: bool
+        """
+        if self._load(upload_id) is None:
+            return False
+        for ext in ("data", "json"):
+            path = self._path(upload_id, ext)
+            if os.path.isfile(path):
+                os.remove(path)
+        return True
+
+    def cleanup(self):
+        """
+        Delete the expired sessions
+        :return: list - the ids of the deleted sessions
+        """
+        self._cleaned_at = time.time()
+        deleted = []
+        for filename in os.listdir(self.directory):
+            upload_id, ext = os.path.splitext(filename)
+            if ext == ".json":
+                state = self._load(upload_id)
+                if state and state["created_at"] + self.expires < time.time():
+                    self.delete(upload_id)
+                    deleted.append(upload_id)
+        return deleted
+
+    def _complete(self, upload_id, state):
+        """
+        Upload the complete file to the storage, as a stream
+        """
+        path = self._path(upload_id, "data")
+        with open(path, "rb") as f:
+            obj = self.storage.upload(FileStorage(stream=f,
+                                                  filename=state["filename"],
+                                                  content_type=state["content_type"]),
+                                      **self.upload_kwargs)
+        state["object"] = obj.name
+        state.pop("offset", None)
+        self._save(upload_id, state)
+        os.remove(path)
+
+    def _path(self, upload_id, ext):
+        if not self.ID_REGEXP.match(upload_id):
+            raise ValueError("Invalid upload id '%s'" % upload_id)
+        return os.path.join(self.directory, "%s.%s" % (upload_id, ext))
+
+    def _load(self, upload_id):
+        try:
+            with open(self._path(upload_id, "json")) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _save(self, upload_id, state):
+        path = self._path(upload_id, "json")
+        tmp_path = "%s.%s" % (path, uuid.uuid4().hex)
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.rename(tmp_path, path)
+
+
+def parse_upload_metadata(value):
+    """
+    Parse the `Upload-Metadata` header of the tus protocol,
+    ie: `filename d29ybGRfZG9taW5hdGlvbl9wbGFuLnBkZg==,is_confidential`
+    :param value: str
+    :return: dict
+    """
+    metadata = {}
+    for pair in (value or "").split(","):
+        parts = pair.strip().split(" ", 1)
+        if parts[0]:
+            metadata[parts[0]] = base64.b64decode(parts[1]).decode("utf-8") if len(parts) > 1 else ""
+    return metadata
+
+
+class _SizeLimitedStream(object):
+    """
+    Read a stream by chunks, and abort once it exceeds max_size
+    """
+
+    def __init__(self, stream, max_size=None, chunk_size=CHUNK_SIZE):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self.max_size = max_size
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise InvalidSizeError("File size exceeds the max size of %s bytes" % self.max_size)
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(self._chunk_size), b"")
+
+
+class _StreamTee(object):
+    """
+    Read a stream once and feed its chunks to several iterators,
+    each one consumed by a different thread
+    """
+
+    def __init__(self, stream, count, chunk_size=CHUNK_SIZE, buffer_size=16):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._queues = [queue.Queue(buffer_size) for _ in range(count)]
+        self._closed = [False] * count
+
+    def iterator(self, index):
+        """
+        Return the iterator of the consumer at index
+        :param index: int
+        :return: generator
+        """
+        q = self._queues[index]
+        while True:
+            chunk = q.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def close(self, index):
+        """
+        Stop feeding the consumer at index, ie: when it failed
+        :param index: int
+        """
+        self._closed[index] = True
+
+    def run(self):
+        """
+        Read the stream until exhausted, feeding all the open consumers.
+        If reading fails, the consumers fail with the same exception
+        """
+        try:
+            while True:
+                chunk = self._stream.read(self._chunk_size)
+                for index in range(len(self._queues)):
+                    self._put(index, chunk or None)
+                if not chunk:
+                    break
+        except Exception as e:
+            for index in range(len(self._queues)):
+                self._put(index, e)
+            raise
+
+    def _put(self, index, chunk):
+        while not self._closed[index]:
+            try:
+                self._queues[index].put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+class _ChunkQueue(object):
+    """
+    A bounded queue of chunks, from a producer thread to a consumer.
+    The producer `write`s and ends with `finish()`, the consumer iterates or `read`s.
+    Once the consumer `close`s it, the producer fails on its next write
+    """
+
+    def __init__(self, buffer_size=16):
+        self._queue = queue.Queue(buffer_size)
+        self._closed = False
+        self._eof = False
+        self._buffer = b""
+        self._size = 0
+
+    def write(self, data):
+        if data:
+            if not self._put(bytes(data)):
+                raise IOError("The stream was closed by the reader")
+            self._size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        pass
+
+    def finish(self, error=None):
+        """
+        End the stream. The reader fails with `error` if any
+        :param error: Exception
+        """
+        self._put(error)
+
+    def close(self):
+        self._closed = True
+
+    def read(self, size=-1):
+        data = self._buffer
+        while size < 0 or len(data) < size:
+            chunk = self._get()
+            if not chunk:
+                break
+            data += chunk
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+    def __iter__(self):
+        while True:
+            chunk = self._get()
+            if not chunk:
+                return
+            yield chunk
+
+    def _get(self):
+        if self._eof:
+            return b""
+        chunk = self._queue.get()
+        if chunk is None or isinstance(chunk, Exception):
+            self._eof = True
+            if chunk is not None:
+                raise chunk
+            return b""
+        return chunk
+
+    def _put(self, chunk):
+        while not self._closed:
+            try:
+                self._queue.put(chunk, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+class _Prefetcher(object):
+    """
+    Download the streams of the next `workers` objects concurrently,
+    and hand them in order, as _ChunkQueue to read from
+    """
+
+    def __init__(self, objects, open_stream, workers=4):
+        """
+        :param objects: iterable - the objects
+        :param open_stream: callable - return the iterator of chunks of an object
+        :param workers: int
+        """
+        self._objects = iter(objects)
+        self._open_stream = open_stream
+        self._workers = max(1, workers)
+        self._pending = []
+
+    def __iter__(self):
+        self._fill()
+        while self._pending:
+            obj, stream = self._pending.pop(0)
+            yield obj, stream
+            stream.close()
+            self._fill()
+
+    def close(self):
+        """
+        Stop all the downloads
+        """
+        for _, stream in self._pending:
+            stream.close()
+        self._pending = []
+
+    def _fill(self):
+        while len(self._pending) < self._workers:
+            obj = next(self._objects, None)
+            if obj is None:
+                return
+            stream = _ChunkQueue()
+            thread = threading.Thread(target=self._download, args=(obj, stream))
+            thread.daemon = True
+            thread.start()
+            self._pending.append((obj, stream))
+
+    def _download(self, obj, stream):
+        try:
+            for chunk in self._open_stream(obj):
+                stream.write(chunk)
+            stream.finish()
+        except Exception as e:
+            stream.finish(e)
+
+
+def _write_archive(output, objects, format):
+    """
+    Write an archive of the objects, without seeking
+    :param output: file object
+    :param objects: iterable of (driver object, file object to read its content)
+    :param format: str - zip, tar or tar.gz
+    """
+    if format == "zip":
+        import zipfile
+
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for obj, stream in objects:
+                mtime = get_mtime(obj.extra)
+                date_time = time.localtime(mtime)[:6] if mtime else None
+                if date_time is None or date_time[0] < 1980:
+                    date_time = (1980, 1, 1, 0, 0, 0)
+                info = zipfile.ZipInfo(obj.name, date_time=date_time)
+                info.file_size = obj.size or 0
+                info.external_attr = 0o644 << 16
+                with zf.open(info, "w") as dest:
+                    for chunk in stream:
+                        dest.write(chunk)
+    else:
+        import tarfile
+
+        with tarfile.open(fileobj=output, mode="w|gz" if format == "tar.gz" else "w|") as tf:
+            for obj, stream in objects:
+                info = tarfile.TarInfo(obj.name)
+                info.size = obj.size or 0
+                info.mtime = get_mtime(obj.extra) or time.time()
+                info.mode = 0o644
+                tf.addfile(info, stream)
+
+
+class ReplicatedStorage(object):
+    """
+    Write objects to several storages at once, and read them from the fastest one
+
+    @property
+        storages
+        write_quorum
+        pending_repairs
+
+    @method
+        upload()
+        get()
+        repair()
+        verify()
+    """
+
+    def __init__(self,
+                 storages,
+                 write_quorum=None,
+                 repair_interval=None,
+                 cooldown=30):
+        """
+        :param storages: list - the Storage instances to replicate to. The first one is the primary
+        :param write_quorum: int - the number of storages an upload must reach to succeed.
+                Default: all of them
+        :param repair_interval: int - seconds between background repairs of the failed replicas.
+                If None, call `repair()` yourself
+        :param cooldown: int - seconds a storage that failed is skipped for reads
+        """
+        if not storages:
+            raise ValueError("'storages' is missing")
+        self.storages = list(storages)
+        self.write_quorum = write_quorum or len(self.storages)
+        if self.write_quorum > len(self.storages):
+            raise ValueError("'write_quorum' is bigger than the number of storages")
+        self.cooldown = cooldown
+        self._latency = [0.0] * len(self.storages)
+        self._failed_at = [None] * len(self.storages)
+        self._repairs = []
+        # The (object_name, storage index) not to repair from, as their content is bad
+        self._corrupted = set()
+        self._lock = threading.Lock()
+
+        if repair_interval:
+            thread = threading.Thread(target=self._repair_forever, args=(repair_interval,))
+            thread.daemon = True
+            thread.start()
+
+    @property
+    def primary(self):
+        return self.storages[0]
+
+    @property
+    def pending_repairs(self):
+        """
+        The list of (object_name, storage index) waiting for repair
+        :return: list
+        """
+        with self._lock:
+            return list(self._repairs)
+
+    def __iter__(self):
+        return self._read(lambda s: iter(s))
+
+    def __len__(self):
+        return self._read(lambda s: len(s))
+
+    def __contains__(self, object_name):
+        return self._read(lambda s: object_name in s)
+
+    def get(self, object_name):
+        """
+        Return an object from the fastest healthy storage, or None if it doesn't exist
+        :param object_name:
+        :return: Object
+        """
+        return self._read(lambda s: s.get(object_name))
+
+    def upload(self,
+               file,
+               name=None,
+               prefix=None,
+               extensions=None,
+               overwrite=False,
+               public=False,
+               random_name=False,
+               max_size=None,
+               mimetypes=None,
+               **kwargs):
+        """
+        To upload a file to all the storages concurrently.
+        The params are the same as `Storage.upload`.
+        Streams are read once and fed to all the storages.
+        :return: Object - the object of the first storage that succeeded
+        """
+        with self.primary._prepare_upload(file,
+                                          name=name,
+                                          prefix=prefix,
+                                          extensions=extensions,
+                                          overwrite=overwrite,
+                                          public=public,
+                                          random_name=random_name,
+                                          max_size=max_size,
+                                          mimetypes=mimetypes,
+                                          storages=self.storages,
+                                          **kwargs) as (file, name, extra, max_size):
+            tee = None
+            if isinstance(file, FileStorage):
+                tee = _StreamTee(_SizeLimitedStream(file.stream, max_size), len(self.storages))
+
+            results = [None] * len(self.storages)
+            errors = {}
+
+            def _upload(index, storage):
+                try:
+                    if tee:
+                        obj = storage._put_object(name, iterator=tee.iterator(index), extra=extra)
+                    else:
+                        obj = storage._put_object(name, file_path=file, extra=extra)
+                    results[index] = Object(obj=obj, throttles=storage.throttles, storage=storage)
+                except Exception as e:
+                    errors[index] = e
+                finally:
+                    if tee:
+                        tee.close(index)
+
+            threads = [threading.Thread(target=_upload, args=(i, s))
+                       for i, s in enumerate(self.storages)]
+            for thread in threads:
+                thread.start()
+            try:
+                if tee:
+                    tee.run()
+            finally:
+                for thread in threads:
+                    thread.join()
+
+            for index in errors:
+                self._mark_failed(index)
+
+            if len(self.storages) - len(errors) < self.write_quorum:
+                raise ReplicationError("Upload of '%s' reached %s of %s storages, "
+                                       "write quorum is %s"
+                                       % (name, len(self.storages) - len(errors),
+                                          len(self.storages), self.write_quorum),
+                                       errors=errors)
+
+            with self._lock:
+                for index in errors:
+                    self._repairs.append((name, index))
+
+            return [o for o in results if o is not None][0]
+
+    def repair(self):
+        """
+        Copy the objects that failed to replicate from a healthy storage
+        :return: list - the (object_name, storage index) that are still pending
+        """
+        with self._lock:
+            repairs, self._repairs = self._repairs, []
+
+        pending = []
+        for object_name, index in repairs:
+            try:
+                self._repair_object(object_name, index)
+                with self._lock:
+                    self._corrupted.discard((object_name, index))
+            except Exception:
+                self._mark_failed(index)
+                pending.append((object_name, index))
+
+        with self._lock:
+            self._repairs.extend(pending)
+        return pending
+
+    def _repair_object(self, object_name, index):
+        from libcloud.storage.types import ObjectDoesNotExistError
+
+        target = self.storages[index]
+        for i in self._ranked():
+            if i == index or (object_name, i) in self._corrupted:
+                continue
+            obj = self.storages[i].get(object_name)
+            if obj is not None:
+                target._put_object(object_name,
+                                   iterator=obj.as_stream(),
+                                   extra={"meta_data": obj.meta_data or {}})
+                return
+        raise ObjectDoesNotExistError(value=None, driver=target.driver, object_name=object_name)
+
+    def verify(self, prefix=None, workers=4, checkpoint=None, throttle=None):
+        """
+        Verify the objects on all the storages concurrently (see `Storage.verify`),
+        and queue the repair of the replicas that mismatch or are missing.
+        They are repaired from a replica that verified
+        :param prefix: str
+        :param workers: int - number of objects hashed in parallel on each storage
+        :param checkpoint: str - path of the checkpoints, suffixed with the storage index
+        :param throttle: Throttle - to limit the scan, on top of the storages limits
+        :return: list - the report of each storage
+        """
+        def _verify(item):
+            index, storage = item
+            return storage.verify(prefix=prefix,
+                                  workers=workers,
+                                  checkpoint="%s.%s" % (checkpoint, index) if checkpoint else None,
+                                  throttle=throttle)
+
+        reports = [None] * len(self.storages)
+        for (index, _), report, error in run_parallel(_verify,
+                                                      list(enumerate(self.storages)),
+                                                      len(self.storages)):
+            if error:
+                raise error
+            reports[index] = report
+
+        repairs = []
+        corrupted = set()
+        verified = [set(report["verified"]) for report in reports]
+        for name in sorted(set().union(*verified)):
+            good = [index for index, report in enumerate(reports)
+                    if name in verified[index] and name not in report["mismatches"]]
+            if not good:
+                continue
+            for index, report in enumerate(reports):
+                if index in good or name in report["errors"]:
+                    continue
+                repairs.append((name, index))
+                if name in report["mismatches"]:
+                    corrupted.add((name, index))
+
+        with self._lock:
+            self._corrupted.update(corrupted)
+            pending = set(self._repairs)
+            self._repairs.extend(r for r in repairs if r not in pending)
+        return reports
+
+    def _repair_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            self.repair()
+
+    def _mark_failed(self, index):
+        self._failed_at[index] = time.time()
+
+    def _ranked(self):
+        """
+        Return the storage indexes, healthy ones first, fastest first
+        :return: list
+        """
+        now = time.time()
+
+        def _rank(index):
+            failed_at = self._failed_at[index]
+            unhealthy = failed_at is not None and now - failed_at < self.cooldown
+            return unhealthy, self._latency[index]
+        return sorted(range(len(self.storages)), key=_rank)
+
+    def _read(self, func):
+        """
+        Run a read on the fastest healthy storage, falling back on the next ones
+        :param func: callable - receives a Storage
+        """
+        error = None
+        for index in self._ranked():
+            start = time.time()
+            try:
+                result = func(self.storages[index])
+            except Exception as e:
+                self._mark_failed(index)
+                error = e
+                continue
+            elapsed = time.time() - start
+            # Exponentially weighted moving average of the latency
+            self._latency[index] = elapsed if not self._latency[index] \
+                else 0.8 * self._latency[index] + 0.2 * elapsed
+            return result
+        raise error
+
 
 class Object(object):
     """
@@ -464,6 +3422,20 @@ class Object(object):
     def __getattr__(self, item):
         return getattr(self._obj, item)
 
+    @property
+    def _storage(self):
+        """
+        The storage the object comes from, or None
+        """
+        return self._kwargs.get("storage")
+
+    @property
+    def _throttles(self):
+        """
+        The throttles of the storage the object comes from
+        """
+        return self._kwargs.get("throttles")
+
     def __len__(self):
         return self.size
 
@@ -618,11 +3590,60 @@ class Object(object):
         if name:
             obj_path = "%s/%s.%s" % (destination, name, self.extension)
 
-        file = self._obj.download(obj_path,
-                                  overwrite_existing=overwrite,
-                                  delete_on_failure=delete_on_failure)
+        # Concurrent saves of the object to the same path share a single download
+        key = ("save_to", self.driver.name, self.driver.key, self.container.name, self.name,
+               os.path.abspath(obj_path))
+        file = _flights.do(key,
+                           self.download,
+                           obj_path,
+                           overwrite_existing=overwrite,
+                           delete_on_failure=delete_on_failure)
         return obj_path if file else None
 
+    def download(self, destination_path, overwrite_existing=False, delete_on_failure=True):
+        """
+        Download the object to a local path, within the limits of the
+        throttles of the storage it comes from
+        :param destination_path: str
+        :param overwrite_existing: bool
+        :param delete_on_failure: bool
+        :return: bool
+        """
+        throttles = self._throttles
+        if not throttles:
+            return self._obj.download(destination_path,
+                                      overwrite_existing=overwrite_existing,
+                                      delete_on_failure=delete_on_failure)
+
+        from libcloud.common.types import LibcloudError
+
+        if os.path.exists(destination_path) and not overwrite_existing:
+            raise LibcloudError(value="File %s already exists, but overwrite_existing=False"
+                                      % destination_path,
+                                driver=self.driver)
+        try:
+            with throttle_slots(throttles):
+                stream = self.driver.download_object_as_stream(self._obj, CHUNK_SIZE)
+                with open(destination_path, "wb") as f:
+                    for chunk in throttle_iterator(stream, throttles):
+                        f.write(chunk)
+        except Exception:
+            if delete_on_failure and os.path.isfile(destination_path):
+                os.remove(destination_path)
+            raise
+        return True
+
+    def delete(self):
+        """
+        Delete the object. It goes through the storage it comes from,
+        so the index is updated and the deleted event is sent
+        :return: bool
+        """
+        storage = self._storage
+        if storage is None:
+            return self._obj.delete()
+        return self.name in storage.delete_many([self.name])
+
     def download_url(self, timeout=60, name=None):
         """
         Trigger a browse download
@@ -664,3 +3685,82 @@ class Object(object):
                 raise NotImplemented("This provider '%s' doesn't support or "
                                      "doesn't have a signed url "
                                      "implemented yet" % self.provider_name)
+
+
+class ListedObject(Object):
+    """
+    A compact object, as returned when iterating over the storage.
+    It only holds the name, size, hash and mtime (parsed on access).
+    The `extra` and `meta_data` are loaded from the driver on first access.
+    """
+
+    __slots__ = ("name", "size", "hash", "container", "driver", "_mtime",
+                 "_driver_obj", "_loaded", "_storage", "_throttles")
+
+    def __init__(self, name, size, hash, mtime, container, driver, storage=None, throttles=()):
+        self.name = name
+        self.size = size
+        self.hash = hash
+        self._mtime = mtime
+        self.container = container
+        self.driver = driver
+        self._driver_obj = None
+        self._loaded = False
+        self._storage = storage
+        self._throttles = throttles
+
+    @classmethod
+    def from_driver_object(cls, obj, **kwargs):
+        """
+        Create it from a libcloud object, keeping only the listing data
+        :param obj: libcloud.storage.base.Object
+        :return: ListedObject
+        """
+        extra = obj.extra or {}
+        return cls(name=obj.name,
+                   size=obj.size,
+                   hash=obj.hash,
+                   mtime=extra.get("modify_time") or extra.get("last_modified"),
+                   container=obj.container,
+                   driver=obj.driver,
+                   **kwargs)
+
+    @property
+    def _obj(self):
+        """
+        The libcloud object. A light one is created to download, delete etc.
+        The full one is loaded from the driver with `extra` or `meta_data`
+        """
+        from libcloud.storage.base import Object as BaseObject
+
+        if self._driver_obj is None:
+            self._driver_obj = BaseObject(container=self.container,
+                                          driver=self.driver,
+                                          name=self.name,
+                                          size=self.size,
+                                          hash=self.hash,
+                                          extra={},
+                                          meta_data={})
+        return self._driver_obj
+
+    def _load(self):
+        if not self._loaded:
+            self._driver_obj = self.driver.get_object(self.container.name, self.name)
+            self._loaded = True
+        return self._driver_obj
+
+    @property
+    def mtime(self):
+        """
+        The modification timestamp
+        :return: float
+        """
+        return parse_mtime(self._mtime)
+
+    @property
+    def extra(self):
+        return self._load().extra
+
+    @property
+    def meta_data(self):
+        return self._load().meta_data
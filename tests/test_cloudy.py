@@ -1,4 +1,5 @@
 import os
+import hashlib
 import pytest
 from libcloud.storage.base import (StorageDriver, Container)
 from flask_cloudy import (get_file_extension,
@@ -8,7 +9,23 @@ from flask_cloudy import (get_file_extension,
                             get_provider_name,
                             Storage,
                             Object,
-                            InvalidExtensionError)
+                            ListedObject,
+                            ObjectIndex,
+                            LocalCache,
+                            ReplicatedStorage,
+                            ShardedLocalStorageDriver,
+                            SingleFlight,
+                            get_file_md5,
+                            get_object_md5,
+                            Throttle,
+                            ThrottleGroup,
+                            JournalSink,
+                            WebhookSink,
+                            WebhookStub,
+                            ReplicationError,
+                            InvalidExtensionError,
+                            InvalidSizeError,
+                            InvalidMimeTypeError)
 from tests import config
 
 CWD = os.path.dirname(__file__)
@@ -216,6 +233,577 @@ def test_upload_image_from_url():
     o = storage.upload(url)
     assert isinstance(o, Object)
 
+def test_local_cache(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container")))
+    o = storage.upload(CWD + "/data/hello.txt", name="my-txt-hello-cached.txt", overwrite=True)
+    cache = LocalCache(str(tmpdir.mkdir("cache")))
+    path = cache.get_path(o)
+    assert path.startswith(str(tmpdir.join("cache")))
+    assert o in cache
+    assert cache.get_path(o) == path
+    with open(path) as f, open(CWD + "/data/hello.txt") as f2:
+        assert f.read() == f2.read()
+
+class RemoteDriver(StorageDriver):
+    """
+    A remote provider stand in, backed by a LOCAL driver
+    """
+    name = "Remote"
+
+    def __init__(self, key, secret=None, **kwargs):
+        from libcloud.storage.drivers.local import LocalStorageDriver
+        self.key = key
+        self._local = LocalStorageDriver(key)
+
+    def get_container(self, container_name):
+        return self._local.get_container(container_name)
+
+    def get_object(self, container_name, object_name):
+        return self._local.get_object(container_name, object_name)
+
+def test_files_server_cache(tmpdir):
+    from flask import Flask
+    tmpdir.mkdir("bucket").join("a.txt").write("Hello World")
+    config = dict(STORAGE_PROVIDER="tests.test_cloudy.RemoteDriver",
+                  STORAGE_KEY=str(tmpdir),
+                  STORAGE_CONTAINER="bucket",
+                  STORAGE_CACHE_DIR=str(tmpdir.join("cache")))
+
+    # Not served without the opt in
+    app = Flask(__name__)
+    app.config.update(config)
+    Storage(app=app)
+    assert app.test_client().get("/files/a.txt").status_code == 404
+
+    app = Flask(__name__)
+    app.config.update(config, STORAGE_SERVER_CACHE=True)
+    storage = Storage(app=app)
+    response = app.test_client().get("/files/a.txt?dl=1")
+    assert response.status_code == 200
+    assert response.data == b"Hello World"
+    assert "a.txt" in response.headers["Content-Disposition"]
+    response.close()
+    assert storage.get("a.txt") in storage.cache
+    assert app.test_client().get("/files/idonexist.txt").status_code == 404
+
+def test_local_cache_eviction(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container")))
+    f = tmpdir.join("hello.txt")
+    f.write("Hello World")
+    o = storage.upload(str(f), name="my-txt-hello-cached1.txt", overwrite=True)
+    o2 = storage.upload(str(f), name="my-txt-hello-cached2.txt", overwrite=True)
+    cache = LocalCache(str(tmpdir.mkdir("cache")), max_size=o.size + 1)
+    cache.get_path(o)
+    cache.get_path(o2)
+    assert o not in cache
+    assert o2 in cache
+    assert len(cache) == 1
+
+def test_local_cache_foreign_files(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container")))
+    o = storage.upload(CWD + "/data/hello.txt", name="my-txt-hello-cached.txt", overwrite=True)
+    directory = tmpdir.mkdir("cache")
+    directory.join(".env").write("SECRET=1")
+    directory.join("user-data.bin").write("x" * 1000)
+    directory.mkdir(".git")
+    directory.join(".%s.txt.%s" % ("a" * 40, "b" * 32)).write("partial")
+    cache = LocalCache(str(directory), max_size=100)
+    assert len(cache) == 0
+    cache.get_path(o)
+    cache.clear()
+    assert sorted(os.listdir(str(directory))) == [".env", ".git", "user-data.bin"]
+
+def test_replicated_upload(tmpdir):
+    import werkzeug
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container_1")))
+    storage2 = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container_2")))
+    replicated = ReplicatedStorage([storage, storage2])
+    object_name = "my-txt-hello-replicated.txt"
+    with open(CWD + "/data/hello.txt", "rb") as fp:
+        file = werkzeug.datastructures.FileStorage(fp, filename=object_name)
+        o = replicated.upload(file, overwrite=True)
+    assert o.name == object_name
+    assert object_name in storage
+    assert object_name in storage2
+    assert replicated.get(object_name) is not None
+
+def test_replicated_upload_quorum(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container_1")))
+    container = tmpdir.mkdir("container_2")
+    storage2 = Storage(provider="LOCAL", container=str(container))
+    object_name = "my-txt-hello-replicated2.txt"
+    container.remove()
+    with pytest.raises(ReplicationError):
+        ReplicatedStorage([storage, storage2]).upload(CWD + "/data/hello.txt", name=object_name, overwrite=True)
+
+    replicated = ReplicatedStorage([storage, storage2], write_quorum=1)
+    o = replicated.upload(CWD + "/data/hello.txt", name=object_name, overwrite=True)
+    assert o.name == object_name
+    assert replicated.pending_repairs == [(object_name, 1)]
+    container.ensure(dir=True)
+    assert replicated.repair() == []
+    assert object_name in storage2
+
+def test_replicated_upload_no_overwrite(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container_1")))
+    storage2 = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container_2")))
+    tmpdir.join("container_2").join("a.txt").write("precious")
+    f = tmpdir.join("a.txt")
+    f.write("new")
+    o = ReplicatedStorage([storage, storage2]).upload(str(f))
+    assert o.name != "a.txt"
+    assert tmpdir.join("container_2").join("a.txt").read() == "precious"
+    assert o.name in storage2
+
+def test_sync(tmpdir):
+    storage = Storage(provider="LOCAL",
+                      container=str(tmpdir.mkdir("container")),
+                      allowed_extensions=["txt", "js"])
+    local_dir = tmpdir.mkdir("build")
+    local_dir.join("a.txt").write("a")
+    local_dir.mkdir("sub").join("b.js").write("b")
+    local_dir.join("evil.php").write("<?php")
+    manifest = str(tmpdir.join("manifest.json"))
+
+    r = storage.sync(str(local_dir), prefix="sync/", dry_run=True)
+    assert r["uploaded"] == ["sync/a.txt", "sync/sub/b.js"]
+    assert r["skipped"] == ["sync/evil.php"]
+    assert "sync/a.txt" not in storage
+
+    r = storage.sync(str(local_dir), prefix="sync/", manifest=manifest)
+    assert r["uploaded"] == ["sync/a.txt", "sync/sub/b.js"]
+    assert "sync/sub/b.js" in storage
+    assert "sync/evil.php" not in storage
+
+    r = storage.sync(str(local_dir), prefix="sync/", manifest=manifest)
+    assert r["uploaded"] == []
+    assert sorted(r["unchanged"]) == ["sync/a.txt", "sync/sub/b.js"]
+
+    # Without a manifest, LOCAL objects are compared with their content
+    r = storage.sync(str(local_dir), prefix="sync/")
+    assert r["uploaded"] == []
+
+    # The objects filtered out are not deleted
+    r = storage.sync(str(local_dir), prefix="sync/", extensions=["js"], delete=True)
+    assert r["deleted"] == []
+    assert "sync/a.txt" in storage
+
+    local_dir.join("a.txt").write("aa")
+    local_dir.join("sub").join("b.js").remove()
+    r = storage.sync(str(local_dir), prefix="sync/", delete=True, manifest=manifest)
+    assert r["uploaded"] == ["sync/a.txt"]
+    assert r["deleted"] == ["sync/sub/b.js"]
+    assert "sync/sub/b.js" not in storage
+
+def test_copy(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container")))
+    f = tmpdir.join("hello.txt")
+    f.write("Hello World")
+    o = storage.upload(str(f), name="my-txt-hello-to-copy.txt", overwrite=True)
+    o2 = storage.copy(o.name, "copies/my-txt-hello-copy.txt", overwrite=True)
+    assert o2.name == "copies/my-txt-hello-copy.txt"
+    assert o.name in storage
+    assert o2.size == o.size
+
+    # Overwriting the copy doesn't change the original
+    f.write("Hello")
+    storage.upload(str(f), name="my-txt-hello-copy.txt", prefix="copies/", overwrite=True)
+    assert storage.get(o.name).size == len("Hello World")
+    assert storage.get(o2.name).size == len("Hello")
+
+    o3 = storage.copy(o.name, o2.name)
+    assert o3.name != o2.name
+
+def test_move(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container")))
+    o = storage.upload(CWD + "/data/hello.txt", name="my-txt-hello-to-move.txt", overwrite=True)
+    o2 = storage.move(o.name, "moved/my-txt-hello-moved.txt", overwrite=True)
+    assert o2.name == "moved/my-txt-hello-moved.txt"
+    assert o.name not in storage
+    assert o2.name in storage
+
+def test_prefix_copy_move_delete(tmpdir):
+    container = tmpdir.mkdir("container")
+    storage = Storage(provider="LOCAL", container=str(container))
+    for i in range(3):
+        storage.upload(CWD + "/data/hello.txt", name="hello-%s.txt" % i, prefix="dir-a/", overwrite=True)
+    copies = storage.copy_prefix("dir-a/", "dir-b/", overwrite=True)
+    assert sorted(o.name for o in copies) == ["dir-b/hello-0.txt", "dir-b/hello-1.txt", "dir-b/hello-2.txt"]
+    storage.move_prefix("dir-b/", "dir-c/", overwrite=True)
+    assert "dir-b/hello-0.txt" not in storage
+    assert "dir-c/hello-0.txt" in storage
+
+    assert storage.delete_many(["dir-a/hello-0.txt", "dir-a/idonexist.txt"]) == ["dir-a/hello-0.txt"]
+    assert "dir-a/hello-0.txt" not in storage
+    assert sorted(storage.delete_prefix("dir-c/")) == ["dir-c/hello-0.txt", "dir-c/hello-1.txt", "dir-c/hello-2.txt"]
+    assert not container.join("dir-c").check()
+
+def test_stream_archive(tmpdir):
+    import io
+    import tarfile
+    import zipfile
+    from flask import Flask
+    storage = Storage(provider="LOCAL", container=str(tmpdir))
+    for i in range(5):
+        path = tmpdir.join("file-%s.txt" % i)
+        path.write(b"x" * (i * 100000), mode="wb")
+        storage.upload(str(path), prefix="dir/")
+
+    data = b"".join(storage.stream_archive(prefix="dir/", workers=2))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert sorted(zf.namelist()) == ["dir/file-%s.txt" % i for i in range(5)]
+        assert zf.read("dir/file-4.txt") == b"x" * 400000
+
+    data = b"".join(storage.stream_archive(names=["dir/file-1.txt", "dir/idonexist.txt"], format="tar.gz"))
+    with tarfile.open(fileobj=io.BytesIO(data)) as tf:
+        assert tf.getnames() == ["dir/file-1.txt"]
+        assert tf.extractfile("dir/file-1.txt").read() == b"x" * 100000
+
+    # The client goes away
+    stream = storage.stream_archive(prefix="dir/")
+    next(stream)
+    stream.close()
+
+    with pytest.raises(ValueError):
+        storage.stream_archive(format="rar")
+
+    app = Flask(__name__)
+    app.config.update(STORAGE_PROVIDER="LOCAL", STORAGE_CONTAINER=str(tmpdir))
+    Storage(app=app)
+    response = app.test_client().get("/archives/dir/?format=tar")
+    assert response.mimetype == "application/x-tar"
+    assert "dir.tar" in response.headers["Content-Disposition"]
+    with tarfile.open(fileobj=io.BytesIO(response.data)) as tf:
+        assert len(tf.getnames()) == 5
+
+def test_iter_listed_object(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container")))
+    storage.upload(CWD + "/data/hello.txt", name="my-txt-hello-listed.txt", overwrite=True)
+    o = [o for o in storage if o.name == "my-txt-hello-listed.txt"][0]
+    assert isinstance(o, ListedObject)
+    assert isinstance(o, Object)
+    assert o._storage is storage
+    assert o.mtime > 0
+    assert o.extra["modify_time"] == o.mtime
+    assert o.type == "TEXT"
+
+    # The objects still take any attribute
+    o = storage.get("my-txt-hello-listed.txt")
+    o.owner = "me"
+    assert o.owner == "me"
+
+def test_iter_skips_uploads_in_progress(tmpdir):
+    container = tmpdir.mkdir("container")
+    storage = Storage(provider="LOCAL", container=str(container))
+    storage.upload(CWD + "/data/hello.txt", name="a.txt", prefix="dir/")
+    container.join("dir").join("b.txt.%s.cloudy-tmp" % ("0" * 32)).write("partial")
+    assert [o.name for o in storage] == ["dir/a.txt"]
+    assert len(storage) == 1
+    assert storage.delete_prefix("dir/") == ["dir/a.txt"]
+    assert container.join("dir").join("b.txt.%s.cloudy-tmp" % ("0" * 32)).check()
+
+def test_upload_url_invalid_extension_before_download():
+    storage = app_storage()
+    with pytest.raises(InvalidExtensionError):
+        storage.upload("http://idonexist.invalid/setup.exe?v=1")
+
+def test_upload_max_size(tmpdir):
+    import io
+    import werkzeug
+    container = tmpdir.mkdir("container")
+    storage = Storage(provider="LOCAL", container=str(container))
+    f = tmpdir.join("hello.txt")
+    f.write("Hello World")
+    with pytest.raises(InvalidSizeError):
+        storage.upload(str(f), name="my-txt-hello-too-big.txt", max_size=5)
+
+    file = werkzeug.datastructures.FileStorage(io.BytesIO(b"Hello World"),
+                                               filename="my-txt-hello-too-big.txt",
+                                               content_length=11)
+    with pytest.raises(InvalidSizeError):
+        storage.upload(file, max_size=5)
+
+    # No declared size, it's aborted while streaming
+    file = werkzeug.datastructures.FileStorage(io.BytesIO(b"Hello World"),
+                                               filename="my-txt-hello-too-big.txt")
+    with pytest.raises(InvalidSizeError):
+        storage.upload(file, max_size=5)
+    assert "my-txt-hello-too-big.txt" not in storage
+
+    o = storage.upload(str(f), name="my-txt-hello-not-too-big.txt", max_size=11)
+    assert o.size == 11
+
+    # A rejected overwrite keeps the object
+    storage.upload(werkzeug.datastructures.FileStorage(io.BytesIO(b"original"), filename="keep.txt"),
+                   name="my-txt-hello-keep.txt", overwrite=True)
+    file = werkzeug.datastructures.FileStorage(io.BytesIO(b"x" * 100), filename="keep.txt")
+    with pytest.raises(InvalidSizeError):
+        storage.upload(file, name="my-txt-hello-keep.txt", overwrite=True, max_size=50)
+    assert "my-txt-hello-keep.txt" in storage
+    assert container.join("my-txt-hello-keep.txt").read_binary() == b"original"
+    assert not [name for name in os.listdir(str(container)) if name.endswith(".cloudy-tmp")]
+
+def test_upload_mimetypes(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container")))
+    with pytest.raises(InvalidMimeTypeError):
+        storage.upload(CWD + "/data/hello.txt", mimetypes=["image/*"])
+    o = storage.upload(CWD + "/data/hello.txt", name="my-txt-hello-mimetype.txt", mimetypes=["text/*"])
+    assert isinstance(o, Object)
+
+def test_local_shards(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir), local_shards=2)
+    assert isinstance(storage.driver, ShardedLocalStorageDriver)
+    assert storage.driver.__class__.__name__ != "LocalStorageDriver"
+    o = storage.upload(CWD + "/data/hello.txt", name="hello.txt", prefix="dir1/", overwrite=True)
+    assert o.name == "dir1/hello.txt"
+    assert o.provider_name == "local"
+    assert not tmpdir.join("dir1").check()
+    path = o.get_cdn_url()
+    assert os.path.isfile(path)
+    assert path.endswith(os.path.join("dir1", "hello.txt"))
+    assert len(os.path.relpath(path, str(tmpdir)).split(os.sep)) == 4
+
+    assert "dir1/hello.txt" in storage
+    assert "dir1/idonexist.txt" not in storage
+    assert storage.get("dir1/hello.txt").size == o.size
+    assert [obj.name for obj in storage] == ["dir1/hello.txt"]
+    assert len(storage) == 1
+
+    storage.move("dir1/hello.txt", "dir2/hello.txt", overwrite=True)
+    assert [obj.name for obj in storage] == ["dir2/hello.txt"]
+    storage.get("dir2/hello.txt").delete()
+    assert len(storage) == 0
+
+def test_index_query(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("container")), index=ObjectIndex())
+    for i in range(1, 4):
+        f = tmpdir.join("image-%s.jpg" % i)
+        f.write("x" * i * 10)
+        storage.upload(str(f), prefix="photos/", overwrite=True)
+    storage.upload(CWD + "/data/hello.txt", prefix="photos/", overwrite=True)
+    storage.upload(str(tmpdir.join("image-3.jpg")), name="other.jpg", overwrite=True)
+
+    objects = storage.query(prefix="photos/", type="IMAGE", min_size=20, order_by="size", desc=True)
+    assert [o.name for o in objects] == ["photos/image-3.jpg", "photos/image-2.jpg"]
+    assert isinstance(objects[0], Object)
+    assert objects[0].size == 30
+    assert len(storage.query(extension="txt")) == 1
+
+    storage.delete_many(["photos/image-3.jpg"])
+    storage.move("other.jpg", "photos/other.jpg")
+    assert [o.name for o in storage.query(prefix="photos/", type="IMAGE", min_size=20)] \
+        == ["photos/image-2.jpg", "photos/other.jpg"]
+
+    storage.index.remove(storage._index_key(), ["photos/image-2.jpg"])
+    assert storage.reindex() == 4
+    assert len(storage.query(prefix="photos/", type="IMAGE", min_size=20)) == 2
+
+    assert storage.get("photos/other.jpg").delete()
+    assert storage.query(prefix="photos/", type="IMAGE", min_size=20)[0].delete()
+    assert storage.query(prefix="photos/", type="IMAGE", min_size=20) == []
+
+def test_index_upload_without_mtime():
+    from libcloud.storage.base import Object as BaseObject
+    index = ObjectIndex()
+    old = BaseObject(name="old.jpg", size=1, hash=None, container=None, driver=None, meta_data={},
+                     extra={"last_modified": "2017-01-01T00:00:00.000Z"})
+    new = BaseObject(name="new.jpg", size=1, hash=None, container=None, driver=None, meta_data={},
+                     extra={"acl": "private"})
+    index.add("bucket", [old, new])
+    assert [o["name"] for o in index.query("bucket", order_by="mtime", desc=True)] == ["new.jpg", "old.jpg"]
+
+def test_single_flight():
+    import threading
+    import time
+    flight = SingleFlight()
+    calls = []
+    results = []
+
+    def fetch(value):
+        calls.append(value)
+        time.sleep(0.2)
+        return value * 2
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", fetch, 21)))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [21]
+    assert results == [42] * 5
+    assert len(flight) == 0
+
+    def fail():
+        raise IOError("provider down")
+    with pytest.raises(IOError):
+        flight.do("key", fail)
+    assert flight.do("key", fetch, 1) == 2
+
+def test_throttle(tmpdir):
+    import threading
+    import time
+    path = tmpdir.join("data.txt")
+    path.write(b"x" * 300000, mode="wb")
+    container = tmpdir.mkdir("container")
+    storage = Storage(provider="LOCAL",
+                      container=str(container),
+                      throttle=Throttle(rate=1000000, burst=100000, concurrency=1),
+                      throttle_group=ThrottleGroup(rate=1000000, burst=100000))
+
+    start = time.time()
+    obj = storage.upload(str(path), name="data-1")
+    assert time.time() - start >= 0.15
+    metrics = storage.throttles[0].metrics
+    assert metrics["bytes"] == 300000
+    assert metrics["throttled_time"] > 0
+    assert metrics["active"] == 0
+
+    with storage.throttled("tenant-1") as s:
+        s.get(obj.name).save_to(str(tmpdir), name="copy")
+    assert tmpdir.join("copy.txt").read_binary() == b"x" * 300000
+    assert storage.throttle_group.metrics["tenant-1"]["bytes"] == 300000
+
+    throttle = Throttle(concurrency=1)
+    with storage.use(str(container), throttle=throttle) as s:
+        threads = [threading.Thread(target=s.upload, args=(str(path),), kwargs={"name": "data-%s" % i})
+                   for i in range(2, 4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert throttle.metrics["operations"] == 2
+    assert throttle.metrics["queued_time"] > 0
+
+def _corrupt(path):
+    """ Change the content of a file, but not its size and mtime """
+    stat = os.stat(path)
+    with open(path, "r+b") as f:
+        f.write(b"y")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+def test_verify(tmpdir):
+    import json
+    container = tmpdir.mkdir("container")
+    storage = Storage(provider="LOCAL", container=str(container))
+    for i in range(3):
+        path = tmpdir.join("file-%s.txt" % i)
+        path.write(b"x" * (i * 1000), mode="wb")
+        storage.upload(str(path), prefix="v/")
+    checkpoint = str(tmpdir.join("checkpoint.json"))
+
+    r = storage.verify(prefix="v/", workers=2, checkpoint=checkpoint)
+    assert r["verified"] == ["v/file-0.txt", "v/file-1.txt", "v/file-2.txt"]
+    assert r["mismatches"] == {} and r["errors"] == {}
+
+    _corrupt(str(container.join("v/file-2.txt")))
+    r = storage.verify(prefix="v/", checkpoint=checkpoint)
+    assert r["mismatches"] == {"v/file-2.txt": "content"}
+
+    # Resume an interrupted scan
+    with open(checkpoint) as f:
+        state = json.load(f)
+    obj = storage.get("v/file-1.txt")
+    state["verified"]["v/file-1.txt"] = {"size": obj.size, "hash": obj.hash, "md5": "", "mismatch": None}
+    with open(checkpoint, "w") as f:
+        json.dump(state, f)
+    r = storage.verify(prefix="v/", checkpoint=checkpoint)
+    assert r["skipped"] == ["v/file-1.txt"]
+    assert r["verified"] == ["v/file-0.txt", "v/file-2.txt"]
+    assert r["mismatches"] == {"v/file-2.txt": "content"}
+
+    # Ranged reads
+    obj = storage.container.get_object("v/file-2.txt")
+    md5, size = get_object_md5(storage.driver, obj, range_size=300)
+    assert size == 2000
+    assert md5 == get_file_md5(str(container.join("v/file-2.txt")))
+
+    # Empty objects are not requested
+    container.join("v/empty.txt").write(b"", mode="wb")
+    obj = storage.container.get_object("v/empty.txt")
+    assert get_object_md5(None, obj) == (hashlib.md5(b"").hexdigest(), 0)
+
+def test_replicated_verify(tmpdir):
+    storage = Storage(provider="LOCAL", container=str(tmpdir.mkdir("c1")))
+    storage2 = Storage(provider="LOCAL", container=str(tmpdir.mkdir("c2")))
+    replicated = ReplicatedStorage([storage, storage2])
+    path = tmpdir.join("data.txt")
+    path.write(b"x" * 1000, mode="wb")
+    for name in ["a", "b"]:
+        replicated.upload(str(path), name=name)
+    checkpoint = str(tmpdir.join("checkpoint"))
+    replicated.verify(checkpoint=checkpoint)
+
+    _corrupt(str(tmpdir.join("c2", "a.txt")))
+    os.remove(str(tmpdir.join("c1", "b.txt")))
+    reports = replicated.verify(checkpoint=checkpoint)
+    assert reports[1]["mismatches"] == {"a.txt": "content"}
+    assert sorted(replicated.pending_repairs) == [("a.txt", 1), ("b.txt", 0)]
+    assert replicated.repair() == []
+    assert tmpdir.join("c2", "a.txt").read_binary() == b"x" * 1000
+    assert "b.txt" in storage
+
+def test_resumable_upload(tmpdir):
+    import base64
+    from flask import Flask
+    container = tmpdir.mkdir("container")
+    app = Flask(__name__)
+    app.config.update(STORAGE_PROVIDER="LOCAL",
+                      STORAGE_CONTAINER=str(container),
+                      STORAGE_MAX_SIZE=1000,
+                      STORAGE_UPLOAD_DIR=str(tmpdir.join("uploads")))
+    storage = Storage(app=app)
+    client = app.test_client()
+    data = b"hello resumable world"
+
+    def metadata(filename):
+        return "filename %s,is_public" % base64.b64encode(filename.encode("utf-8")).decode("ascii")
+
+    assert client.post("/uploads/", headers={"Upload-Length": "10",
+                                             "Upload-Metadata": metadata("setup.exe")}).status_code == 415
+    assert client.post("/uploads/", headers={"Upload-Length": "2000",
+                                             "Upload-Metadata": metadata("big.txt")}).status_code == 413
+
+    response = client.post("/uploads/", headers={"Upload-Length": str(len(data)),
+                                                 "Upload-Metadata": metadata("my file.txt")})
+    assert response.status_code == 201
+    assert response.headers["Tus-Resumable"] == "1.0.0"
+    url = response.headers["Location"]
+    patch = {"Content-Type": "application/offset+octet-stream"}
+
+    response = client.patch(url, data=data[:10], headers=dict(patch, **{"Upload-Offset": "0"}))
+    assert response.status_code == 204
+    assert response.headers["Upload-Offset"] == "10"
+    assert client.patch(url, data=data[10:], headers=dict(patch, **{"Upload-Offset": "5"})).status_code == 409
+    assert client.head(url).headers["Upload-Offset"] == "10"
+
+    response = client.patch(url, data=data[10:], headers=dict(patch, **{"Upload-Offset": "10"}))
+    assert response.status_code == 204
+    object_name = response.headers["Upload-Object"]
+    assert object_name == "my-file.txt"
+    assert container.join(object_name).read_binary() == data
+    assert client.head(url).headers["Upload-Object"] == object_name
+
+    assert client.delete(url).status_code == 204
+    assert client.head(url).status_code == 404
+    assert client.head("/uploads/../../etc").status_code == 404
+    assert storage.uploads.get("idonexist") is None
+
+def test_lazy_container():
+    storage = Storage(provider="LOCAL", container=CONTAINER)
+    assert storage._driver is None
+    assert storage._container is None
+    assert isinstance(storage.container, Container)
+    assert isinstance(storage.driver, StorageDriver)
+
+    storage = Storage(provider="LOCAL", container=CONTAINER, warmup=True)
+    storage.warmup(background=False)
+    assert storage._container is not None
+
+    storage = Storage(provider="LOCAL", container=os.path.join(CONTAINER, "missing"))
+    with pytest.raises(Exception):
+        storage.container
+
 
 # def test_object_info():
 #     object_name = "hello.jpg"
@@ -223,3 +811,54 @@ def test_upload_image_from_url():
 #     o = storage.create(object_name)
 #     assert isinstance(o.info, dict)
 #
+
+def test_events(tmpdir):
+    container = tmpdir.mkdir("container")
+    received = []
+    journal = JournalSink(str(tmpdir.join("events.log")))
+    stub = WebhookStub(failures=1)
+    webhook = WebhookSink("http://localhost/events", batch_size=3, interval=0.05, send=stub)
+    storage = Storage(provider="LOCAL", container=str(container), events=[journal, webhook])
+    storage.subscribe(received.append)
+    path = tmpdir.join("hello.txt")
+    path.write("hello")
+
+    obj = storage.upload(str(path), name="hello.txt")
+    storage.upload(str(path), name="hello.txt", overwrite=True)
+    storage.copy("hello.txt", "copy.txt")
+    storage.move("copy.txt", "moved.txt")
+    storage.delete_many(["hello.txt", "idonexist.txt"])
+    storage.get("moved.txt").delete()
+
+    types = ["created", "overwritten", "copied", "copied", "deleted", "deleted", "deleted"]
+    assert [e["type"] for e in received] == types
+    assert received[0]["name"] == "hello.txt"
+    assert received[0]["size"] == obj.size
+    assert received[3]["name"] == "moved.txt"
+    assert received[3]["source"] == "copy.txt"
+    assert sorted(e["name"] for e in received[-2:]) == ["hello.txt", "moved.txt"]
+
+    events = list(journal.read())
+    assert [e["id"] for e, _ in events] == [e["id"] for e in received]
+    assert [e["id"] for e, _ in journal.read(events[3][1])] == [e["id"] for e in received[4:]]
+
+    webhook.flush()
+    assert [e["id"] for e in stub.events] == [e["id"] for e in received]
+    assert all(len(batch) <= 3 for batch in stub.batches)
+    assert webhook.sent == len(received)
+    assert webhook.dropped == 0
+
+    # The sinks subscribed later are used by `use`
+    other = []
+    storage.subscribe(other.append)
+    with storage.use(str(tmpdir.mkdir("container2"))) as s2:
+        s2.upload(str(path), name="hello.txt")
+    assert [e["type"] for e in other] == ["created"]
+    assert other[0]["container"] == str(tmpdir.join("container2"))
+
+    def failing(event):
+        raise ValueError("failed")
+    storage.subscribe(failing)
+    with pytest.warns(UserWarning):
+        storage.upload(str(path), name="other.txt")
+    assert received[-1]["type"] == "created"